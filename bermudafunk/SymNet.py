@@ -1,6 +1,17 @@
+import array
 import asyncio
+import bisect
+import collections
+import enum
+import itertools
+import json
 import logging
+import os
 import re
+import socket
+import tempfile
+import threading
+import time
 import typing
 
 from bermudafunk import base
@@ -10,28 +21,566 @@ logger = logging.getLogger(__name__)
 SymNetRawControllerState = typing.NamedTuple('SymNetRawControllerState', [('controller_number', int), ('controller_value', int)])
 
 
+# '#' + 5 digits controller number + '=' + optional sign + 4 or 5 digits controller value,
+# like the former str regex compiled once for bytes, '$' still accepts a final line feed
+_PUSH_LINE = re.compile(br'#([0-9]{5})=(-?[0-9]{4,5})$')
+# the same lines anywhere in a datagram, delimited by carriage returns or the ends of the datagram
+_PUSH_LINES = re.compile(br'(?<![^\r])#([0-9]{5})=(-?[0-9]{4,5})\n?(?![^\r])')
+
+
+def parse_push_line(line: bytes) -> typing.Optional[SymNetRawControllerState]:
+    """
+    Parse a single pushed line of the form '#NNNNN=VVVV' without decoding it.
+
+    The line is expected without the trailing carriage return. None is returned for malformed lines.
+    """
+    match = _PUSH_LINE.match(line)
+    if match is None:
+        return None
+    return SymNetRawControllerState(int(match.group(1)), int(match.group(2)))
+
+
+def parse_push_lines(data: typing.Union[bytes, memoryview]) -> typing.Iterator[SymNetRawControllerState]:
+    """Yield the controller states of all well formed pushed lines in a datagram, in one pass without copying it"""
+    for controller_number, controller_value in _PUSH_LINES.findall(data):
+        yield SymNetRawControllerState(int(controller_number), int(controller_value))
+
+
+@enum.unique
+class SymNetPriority(enum.IntEnum):
+    """Priority classes of outgoing commands, lower values are sent first"""
+    ON_AIR = 0
+    INTERACTIVE = 1
+    BACKGROUND = 2
+
+
+class SymNetTimeoutError(Exception):
+    """The SymNet device didn't answer a request, even after retransmitting it"""
+    pass
+
+
 class SymNetRawProtocolCallback:
-    def __init__(self, callback: typing.Callable, expected_lines: int, regex: str = None):
+    def __init__(self, callback: typing.Callable, expected_lines: int = 1):
         self._callback = callback
         self.expected_lines = expected_lines
-        self.regex = regex
         self.future = base.loop.create_future()
 
     def callback(self, *args, **kwargs):
         logger.debug("raw protocol callback called")
+        if self.future.done():
+            return
         try:
             result = self._callback(*args, **kwargs)
             self.future.set_result(result)
         except Exception as e:
             self.future.set_exception(e)
 
+    def fail(self, exc: Exception):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class SymNetRequest:
+    """A command sent to the SymNet device together with all callbacks waiting for its reply"""
+    __slots__ = ('key', 'command', 'kind', 'controller_number', 'priority', 'callback_objs', 'sequence', 'attempts',
+                 'queued_time', 'sent_time', 'timeout_handle')
+
+    def __init__(self, key: typing.Hashable, command: str, controller_number: typing.Optional[int] = None,
+                 priority: SymNetPriority = SymNetPriority.INTERACTIVE, kind: str = None):
+        self.key = key
+        self.command = command
+        # the command name like 'CS', used to group metrics
+        self.kind = kind if kind is not None else command.split(None, 1)[0] if command.strip() else ''
+        self.controller_number = controller_number  # only set for GS2 requests, which are answered by value
+        self.priority = priority
+        self.callback_objs = []  # type: typing.List[SymNetRawProtocolCallback]
+        self.sequence = None  # type: typing.Optional[int]
+        self.attempts = 0
+        self.queued_time = 0.0
+        self.sent_time = 0.0
+        self.timeout_handle = None  # type: typing.Optional[asyncio.Handle]
+
+    def callback(self, result):
+        for callback_obj in self.callback_objs:
+            callback_obj.callback(result)
+
+    def fail(self, exc: Exception):
+        for callback_obj in self.callback_objs:
+            callback_obj.fail(exc)
+
+
+class SymNetCorrelation:
+    """
+    Correlates the replies of the SymNet device with the outstanding requests.
+
+    GS2 requests are answered with '<controller number> <value>' and are indexed by the controller number.
+    All other commands are answered with ACK or NAK in the order they were sent.
+    A NAK doesn't tell which command failed, so it's delivered to the oldest outstanding request.
+
+    Requests resolved out of band stay in their queue and are skipped once they reach the head.
+    The optional on_resolved callable is called with every request right before its callbacks are.
+    """
+
+    def __init__(self, on_resolved: typing.Callable[[SymNetRequest], typing.Any] = None):
+        self._on_resolved = on_resolved
+        self._sequence = itertools.count()
+        self._outstanding = collections.OrderedDict()  # type: typing.Dict[int, SymNetRequest]
+        self._acknowledge_queue = collections.deque()  # type: typing.Deque[SymNetRequest]
+        self._value_queues = {}  # type: typing.Dict[int, typing.Deque[SymNetRequest]]
+
+    def __len__(self) -> int:
+        return len(self._outstanding)
+
+    def _register(self, request: SymNetRequest):
+        request.sequence = next(self._sequence)
+        self._outstanding[request.sequence] = request
+
+    def _pop(self, queue: typing.Deque[SymNetRequest]) -> typing.Optional[SymNetRequest]:
+        while queue:
+            request = queue.popleft()
+            if self._outstanding.pop(request.sequence, None) is not None:
+                return request
+        return None
+
+    def _resolve(self, request: SymNetRequest, result):
+        if self._on_resolved is not None:
+            self._on_resolved(request)
+        request.callback(result)
+
+    def discard(self, request: SymNetRequest) -> bool:
+        """Stop waiting for the reply of the request, returns False if it isn't outstanding anymore"""
+        return self._outstanding.pop(request.sequence, None) is not None
+
+    def expect_acknowledge(self, request: SymNetRequest):
+        self._register(request)
+        self._acknowledge_queue.append(request)
+
+    def expect_value(self, controller_number: int, request: SymNetRequest):
+        self._register(request)
+        queue = self._value_queues.get(controller_number)
+        if queue is None:
+            queue = self._value_queues[controller_number] = collections.deque()
+        queue.append(request)
+
+    def acknowledge(self) -> bool:
+        request = self._pop(self._acknowledge_queue)
+        if request is None:
+            return False
+        self._resolve(request, True)
+        return True
+
+    def not_acknowledge(self) -> bool:
+        if not self._outstanding:
+            return False
+        _, request = self._outstanding.popitem(last=False)
+        self._resolve(request, None)
+        return True
+
+    def value(self, controller_number: int, controller_value: int) -> bool:
+        queue = self._value_queues.get(controller_number)
+        if queue is None:
+            return False
+        request = self._pop(queue)
+        if not queue:
+            del self._value_queues[controller_number]
+        if request is None:
+            return False
+        self._resolve(request, controller_value)
+        return True
+
+
+class SymNetRoundTripEstimator:
+    """
+    Estimates the retransmission timeout from measured round trip times like TCP does (RFC 6298):
+    a smoothed round trip time plus four times its smoothed variation, bounded by min_rto and max_rto.
+    """
+    alpha = 1 / 8
+    beta = 1 / 4
+
+    def __init__(self, initial_rto: float = 1.0, min_rto: float = 0.05, max_rto: float = 5.0):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        self.srtt = None  # type: typing.Optional[float]
+        self.rttvar = None  # type: typing.Optional[float]
+        self.rto = initial_rto
+
+    def sample(self, rtt: float):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.beta) * self.rttvar + self.beta * abs(self.srtt - rtt)
+            self.srtt = (1 - self.alpha) * self.srtt + self.alpha * rtt
+        self.rto = min(self.max_rto, max(self.min_rto, self.srtt + 4 * self.rttvar))
+
+
+class SymNetLatencyHistogram:
+    """Counts latencies in buckets with exponentially growing upper bounds, the last bucket counts all above"""
+    bounds = tuple(0.0005 * 2 ** i for i in range(14))  # 0.5 ms up to 4.096 s
+
+    def __init__(self):
+        self.counts = array.array('L', bytes(array.array('L').itemsize * (len(self.bounds) + 1)))
+        self.count = 0
+        self.total = 0.0  # in seconds
+        self.max = 0.0  # in seconds
+
+    def add(self, latency: float):
+        self.counts[bisect.bisect_left(self.bounds, latency)] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, percentile: float) -> float:
+        """Upper bound of the bucket containing the percentile, the maximum for the last bucket"""
+        if not self.count:
+            return 0.0
+        rank = self.count * percentile / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return self.bounds[index] if index < len(self.bounds) else self.max
+        return self.max
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p99': self.percentile(99),
+            'max': self.max,
+            'buckets': list(zip(self.bounds + (float('inf'),), self.counts)),
+        }
+
+
+class SymNetProtocolMetrics:
+    """
+    Counters of a SymNetRawProtocol, updated in place on the hot path.
+
+    Round trip times are only collected for requests answered on their first transmission.
+    """
+    # minimal time span in seconds of the push rate reported by SymNetRawProtocol.collect_metrics
+    rate_interval = 1.0
+
+    def __init__(self):
+        self.round_trip_times = {kind: SymNetLatencyHistogram() for kind in ('CS', 'GS2')}  # type: typing.Dict[str, SymNetLatencyHistogram]
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.naks = 0
+        self.uncaught_naks = 0
+        self.invalid_lines = 0
+        self.push_lines = 0
+        self.push_lines_per_second = 0.0
+        self._rate_push_lines = 0
+        self._rate_time = base.loop.time()
+
+    def round_trip(self, kind: str, rtt: float):
+        histogram = self.round_trip_times.get(kind)
+        if histogram is None:
+            histogram = self.round_trip_times[kind] = SymNetLatencyHistogram()
+        histogram.add(rtt)
+
+    def update_rates(self, now: float):
+        elapsed = now - self._rate_time
+        if elapsed >= self.rate_interval:
+            self.push_lines_per_second = (self.push_lines - self._rate_push_lines) / elapsed
+            self._rate_push_lines = self.push_lines
+            self._rate_time = now
+
+
+class SymNetPriorityStatistics:
+    """Queue depth and waiting time of one priority class of a SymNetCommandScheduler"""
+    __slots__ = ('depth', 'sent', 'total_wait', 'max_wait')
+
+    def __init__(self):
+        self.depth = 0
+        self.sent = 0
+        self.total_wait = 0.0  # in seconds
+        self.max_wait = 0.0  # in seconds
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / self.sent if self.sent else 0.0
+
+    def as_dict(self) -> typing.Dict[str, float]:
+        return {'depth': self.depth, 'sent': self.sent, 'mean_wait': self.mean_wait, 'max_wait': self.max_wait}
+
+
+class SymNetCommandScheduler:
+    """
+    Collects the commands issued within one loop iteration and sends them packed into as few datagrams as possible.
+
+    Only the last pending CS value per controller is sent and pending GS2 requests for the same controller are merged.
+    Every caller keeps its own callback, resolved by the shared reply.
+    A merged command is sent with the highest priority of its callers.
+
+    Pending commands are sent by priority class, limited by a token bucket of rate_limit datagrams per second
+    holding at most rate_burst tokens. Every datagram takes as many pending commands as fit, so a throttled queue
+    still goes out in full datagrams. A rate_limit of None disables the limit.
+
+    Unanswered requests are retransmitted after the estimated retransmission timeout, doubled on every attempt.
+    Once max_attempts transmissions went unanswered the callbacks fail with a SymNetTimeoutError.
+
+    An ACK doesn't tell which command it answers, so commands answered by ACK are sent stop-and-wait: only one
+    datagram of them is awaiting its ACKs at a time, GS2 requests are pipelined regardless. If one command of that
+    batch times out, the whole batch is sent again before any new command answered by ACK. The batch after a
+    retransmitted one waits for a retransmission timeout, so late duplicate ACKs can't answer it.
+    ON_AIR commands don't wait for the retransmissions of a batch: they join its first retransmission, behind the
+    retransmitted commands. So they wait at most one retransmission timeout for a batch in flight, plus the hold-off
+    after it if it was retransmitted before they were queued.
+    """
+    max_attempts = 3
+    rate_limit = 500.0  # type: typing.Optional[float]
+    rate_burst = 100
+
+    def __init__(self, protocol: 'SymNetRawProtocol'):
+        self._protocol = protocol
+        self.round_trip = SymNetRoundTripEstimator()
+        self._pending = {}  # type: typing.Dict[typing.Hashable, SymNetRequest]
+        self._queues = {priority: collections.OrderedDict() for priority in SymNetPriority}  # type: typing.Dict[SymNetPriority, typing.Dict[typing.Hashable, SymNetRequest]]
+        self.statistics = {priority: SymNetPriorityStatistics() for priority in SymNetPriority}  # type: typing.Dict[SymNetPriority, SymNetPriorityStatistics]
+        self._unique = itertools.count()
+        self._flush_handle = None  # type: typing.Optional[asyncio.Handle]
+        self._tokens = float(self.rate_burst)
+        self._tokens_time = base.loop.time()
+        self._acknowledge_batch = set()  # type: typing.Set[SymNetRequest]
+        self._acknowledge_batch_retransmitted = False
+        self._acknowledge_hold_until = 0.0
+        self._retransmissions = set()  # type: typing.Set[SymNetRequest]
+        self.coalesced_commands = 0
+        self.retransmitted_commands = 0
+        self.timed_out_commands = 0
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def _enqueue(self, request: SymNetRequest):
+        self._pending[request.key] = request
+        self._queues[request.priority][request.key] = request
+        self.statistics[request.priority].depth += 1
+        if self._flush_handle is None:
+            self._flush_handle = base.loop.call_soon(self.flush)
+
+    def _dequeue(self, request: SymNetRequest):
+        del self._pending[request.key]
+        del self._queues[request.priority][request.key]
+        self.statistics[request.priority].depth -= 1
+
+    def _schedule(self, key: typing.Hashable, command: str, controller_number: typing.Optional[int],
+                  callback_obj: SymNetRawProtocolCallback, priority: SymNetPriority, kind: str = None) -> SymNetRawProtocolCallback:
+        request = self._pending.get(key)
+        if request is None:
+            request = SymNetRequest(key, command, controller_number, priority, kind)
+            request.queued_time = base.loop.time()
+            self._enqueue(request)
+        else:
+            logger.debug('coalesce pending command %s with %s', request.command, command)
+            request.command = command
+            self.coalesced_commands += 1
+            if priority < request.priority:
+                self._dequeue(request)
+                request.priority = priority
+                self._enqueue(request)
+        request.callback_objs.append(callback_obj)
+        return callback_obj
+
+    def schedule_command(self, command: str, callback_obj: SymNetRawProtocolCallback,
+                         priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        return self._schedule(next(self._unique), command, None, callback_obj, priority)
+
+    def schedule_controller_value(self, controller_number: int, controller_value: int, callback_obj: SymNetRawProtocolCallback,
+                                  priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        command = 'CS {cn:d} {cv:d}\r'.format(cn=controller_number, cv=controller_value)
+        return self._schedule(('CS', controller_number), command, None, callback_obj, priority, 'CS')
+
+    def schedule_value_request(self, controller_number: int, callback_obj: SymNetRawProtocolCallback,
+                               priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        command = 'GS2 {:d}\r'.format(controller_number)
+        return self._schedule(('GS2', controller_number), command, controller_number, callback_obj, priority, 'GS2')
+
+    def _refill_tokens(self, now: float):
+        if self.rate_limit is None:
+            self._tokens = float('inf')
+            return
+        self._tokens = min(float(self.rate_burst), self._tokens + (now - self._tokens_time) * self.rate_limit)
+        self._tokens_time = now
+
+    def flush(self):
+        """Send the pending commands by priority, as far as the rate limit allows"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        now = base.loop.time()
+        self._refill_tokens(now)
+
+        # the ACKs can only be assigned while a single datagram of commands answered by ACK is awaiting them
+        acknowledge_blocked = bool(self._acknowledge_batch) or now < self._acknowledge_hold_until
+        retransmitting = bool(self._retransmissions)
+        passes = [(priority, queue, False) for priority, queue in self._queues.items()]
+        if retransmitting and not acknowledge_blocked and all(request.attempts <= 1 for request in self._retransmissions):
+            # at most one late ACK per retransmitted command is left from the first transmission, so commands for the
+            # air may join the datagram behind them: an ACK of this datagram proves it was executed as a whole
+            passes.append((SymNetPriority.ON_AIR, self._queues[SymNetPriority.ON_AIR], True))
+        acknowledge_datagram = False
+        rate_limited = False
+        datagram = []
+        datagram_size = 0
+        for priority, queue, joining in passes:
+            if rate_limited:
+                break
+            statistics = self.statistics[priority]
+            for request in list(queue.values()):
+                acknowledged = request.controller_number is None
+                if joining:
+                    if not acknowledged:
+                        continue
+                    if not acknowledge_datagram or self._retransmissions:
+                        break
+                elif acknowledged and (acknowledge_blocked or retransmitting and request not in self._retransmissions):
+                    continue
+                if datagram and datagram_size + len(request.command) > self._protocol.max_datagram_size:
+                    self._protocol.write(''.join(datagram))
+                    datagram = []
+                    datagram_size = 0
+                    if acknowledge_datagram:
+                        acknowledge_blocked = True
+                        acknowledge_datagram = False
+                        if acknowledged:
+                            continue
+                if not datagram:
+                    if self._tokens < 1:
+                        rate_limited = True
+                        break
+                    self._tokens -= 1
+
+                del queue[request.key]
+                del self._pending[request.key]
+                self._retransmissions.discard(request)
+                wait = now - request.queued_time
+                statistics.depth -= 1
+                statistics.sent += 1
+                statistics.total_wait += wait
+                statistics.max_wait = max(statistics.max_wait, wait)
+
+                self._transmitted(request)
+                datagram.append(request.command)
+                datagram_size += len(request.command)
+                if acknowledged:
+                    acknowledge_datagram = True
+        if datagram:
+            self._protocol.write(''.join(datagram))
+
+        # commands held back for the ACK batch are flushed once it's resolved or timed out
+        if rate_limited:
+            self._flush_handle = base.loop.call_later((1 - self._tokens) / self.rate_limit, self.flush)
+        elif self._pending and now < self._acknowledge_hold_until:
+            self._flush_handle = base.loop.call_later(self._acknowledge_hold_until - now, self.flush)
+
+    def _transmitted(self, request: SymNetRequest):
+        if request.controller_number is None:
+            self._protocol.correlation.expect_acknowledge(request)
+        else:
+            self._protocol.correlation.expect_value(request.controller_number, request)
+        request.attempts += 1
+        request.sent_time = base.loop.time()
+        timeout = min(self.round_trip.max_rto, self.round_trip.rto * 2 ** (request.attempts - 1))
+        request.timeout_handle = base.loop.call_later(timeout, self._timeout, request)
+        if request.controller_number is None:
+            self._acknowledge_batch.add(request)
+            if request.attempts > 1:
+                self._acknowledge_batch_retransmitted = True
+
+    def resolved(self, request: SymNetRequest):
+        """Called by the correlation for every answered request"""
+        if request.timeout_handle is not None:
+            request.timeout_handle.cancel()
+            request.timeout_handle = None
+        if request.attempts == 1:
+            # Karn's algorithm: the reply of a retransmitted request can't be assigned to a transmission
+            rtt = base.loop.time() - request.sent_time
+            self.round_trip.sample(rtt)
+            self._protocol.metrics.round_trip(request.kind, rtt)
+        if request in self._acknowledge_batch:
+            self._acknowledge_batch.discard(request)
+            if not self._acknowledge_batch:
+                self._acknowledge_batch_resolved()
+
+    def _acknowledge_batch_resolved(self):
+        delay = 0.0
+        if self._acknowledge_batch_retransmitted:
+            # the ACKs of the earlier transmissions may still be on their way
+            self._acknowledge_batch_retransmitted = False
+            delay = self.round_trip.rto
+            self._acknowledge_hold_until = base.loop.time() + delay
+        if self._pending and self._flush_handle is None:
+            self._flush_handle = base.loop.call_later(delay, self.flush)
+
+    def _timeout(self, request: SymNetRequest):
+        request.timeout_handle = None
+        if not self._protocol.correlation.discard(request):
+            return
+
+        if request not in self._acknowledge_batch:
+            self._retry(request)
+            return
+
+        # the remaining ACKs can't be assigned anymore, the whole batch is sent again
+        batch, self._acknowledge_batch = self._acknowledge_batch, set()
+        self._acknowledge_batch_retransmitted = False
+        for member in sorted(batch, key=lambda member: member.sequence):
+            if member is not request:
+                member.timeout_handle.cancel()
+                member.timeout_handle = None
+                self._protocol.correlation.discard(member)
+            self._retry(member)
+
+    def _retry(self, request: SymNetRequest):
+        if request.attempts >= self.max_attempts:
+            logger.error('no reply for %r after %d attempts', request.command, request.attempts)
+            self.timed_out_commands += 1
+            request.fail(SymNetTimeoutError(
+                'No reply for command {!r} after {:d} attempts'.format(request.command, request.attempts)))
+            return
+
+        logger.warning('no reply for %r - retransmit', request.command)
+        self.retransmitted_commands += 1
+        pending = self._pending.get(request.key)
+        if pending is not None:
+            # a newer command is already pending, its reply answers the waiting callers as well
+            pending.callback_objs.extend(request.callback_objs)
+            if request.controller_number is None:
+                self._retransmissions.add(pending)
+            if request.priority < pending.priority:
+                self._dequeue(pending)
+                pending.priority = request.priority
+                self._enqueue(pending)
+            return
+        request.queued_time = base.loop.time()
+        if request.controller_number is None:
+            self._retransmissions.add(request)
+        self._enqueue(request)
+
 
 class SymNetRawProtocol(asyncio.DatagramProtocol):
-    def __init__(self, state_queue: asyncio.Queue):
+    max_datagram_size = 1024  # in bytes, pipelined commands are packed into datagrams up to this size
+
+    def __init__(self, push_callback: typing.Callable[[typing.Dict[int, int]], typing.Any]):
+        """push_callback is called once per datagram with the last pushed value of every controller in it"""
         logger.debug("init a SymNetRawProtocol")
         self.transport = None
-        self.callback_queue = []  # type: typing.List[SymNetRawProtocolCallback]
-        self.state_queue = state_queue
+        self.scheduler = SymNetCommandScheduler(self)
+        self.correlation = SymNetCorrelation(on_resolved=self.scheduler.resolved)
+        self.push_callback = push_callback
+        # set if the controllers of this protocol keep their values in a compact registry
+        self.registry = None  # type: typing.Optional[SymNetControllerRegistry]
+        self.push_updates = 0
+        self.coalesced_push_updates = 0
+        self.metrics = SymNetProtocolMetrics()
+        # set while the device pushes every value change, the cached controller values are authoritative then
+        self.push_active = False
 
     def connection_made(self, transport: asyncio.BaseTransport):
         logger.debug("connection established")
@@ -39,54 +588,56 @@ class SymNetRawProtocol(asyncio.DatagramProtocol):
 
     def datagram_received(self, data: bytes, address):
         logger.debug("a datagram was received - %d bytes", len(data))
-        data_str = data.decode()
-        lines = data_str.split('\r')
-        lines = [lines[i] for i in range(len(lines)) if len(lines[i]) > 0]
-
-        logger.debug("%d non-empty lines received", len(lines))
-
-        if len(self.callback_queue) > 0:
-            logger.debug("iterate over callback queue")
-            for callback_obj in self.callback_queue:
-                if len(lines) == 1 and lines[0] == 'NAK':
-                    logger.debug("got only a NAK - forwarding to the first callback")
-                    callback_obj.callback(data_str)
-                    self.callback_queue.remove(callback_obj)
-                    return
-
-                if callback_obj.regex is not None:
-                    logger.debug("callback comes with a regex - try match on the whole received data string")
-                    m = re.match(callback_obj.regex, data_str)
-                    if m is not None:
-                        logger.debug("regex worked - deliver to callback and remove it")
-                        callback_obj.callback(data_str, m=m)
-                        self.callback_queue.remove(callback_obj)
-                        return
-                elif len(lines) == callback_obj.expected_lines:
-                    logger.debug("callback has no regex, but the expected line count equals to the received one")
-                    callback_obj.callback(data_str)
-                    self.callback_queue.remove(callback_obj)
-                    return
-
-        if len(lines) == 1:
-            if lines[0] == 'NAK':
-                logger.error('Uncaught NAK - this is probably a huge error')
-                return
-            if lines[0] == 'ACK':
-                logger.debug('got an ACK, but no callbacks waiting for input - just ignore it')
-                return
+        self.metrics.datagrams_in += 1
+        self.metrics.bytes_in += len(data)
+        self._process_lines(data)
+
+    def _process_lines(self, data: typing.Union[bytes, bytearray]):
+        """Process complete lines received from the device, pushed values are handed over as one batch"""
+        updates = None  # type: typing.Optional[typing.Dict[int, int]]
+        for line in data.split(b'\r'):
+            if len(line) == 0:
+                continue
 
-        logger.debug("no callbacks defined and not an ACK or NAK - must be pushed data")
-        for line in lines:
-            m = re.match('^#([0-9]{5})=(-?[0-9]{4,5})$', line)
-            if m is None:
-                logger.error("error in in the received line <%s>", line)
+            if line == b'ACK':
+                if not self.correlation.acknowledge():
+                    logger.debug('got an ACK, but no callbacks waiting for input - just ignore it')
+                continue
+
+            if line == b'NAK':
+                self.metrics.naks += 1
+                if not self.correlation.not_acknowledge():
+                    self.metrics.uncaught_naks += 1
+                    logger.error('Uncaught NAK - this is probably a huge error')
                 continue
 
-            asyncio.ensure_future(self.state_queue.put(SymNetRawControllerState(
-                controller_number=int(m.group(1)),
-                controller_value=int(m.group(2))
-            )))
+            if line[0] == 0x23:  # '#' marks pushed data
+                state = parse_push_line(line)
+                if state is None:
+                    self.metrics.invalid_lines += 1
+                    logger.error("error in in the received line <%s>", line)
+                    continue
+
+                if updates is None:
+                    updates = {}
+                elif state.controller_number in updates:
+                    self.coalesced_push_updates += 1
+                updates[state.controller_number] = state.controller_value
+                self.push_updates += 1
+                self.metrics.push_lines += 1
+                continue
+
+            controller_number, _, controller_value = line.partition(b' ')
+            try:
+                delivered = self.correlation.value(int(controller_number), int(controller_value))
+            except ValueError:
+                delivered = False
+            if not delivered:
+                self.metrics.invalid_lines += 1
+                logger.error("error in in the received line <%s>", line)
+
+        if updates:
+            self.push_callback(updates)
 
     def error_received(self, exc):
         logger.error('Error received %s', exc)
@@ -94,35 +645,211 @@ class SymNetRawProtocol(asyncio.DatagramProtocol):
 
     def write(self, data: str):
         logger.debug('send data to symnet %s', data)
+        self.metrics.datagrams_out += 1
+        self.metrics.bytes_out += len(data)
         self.transport.sendto(data.encode())
 
+    def collect_metrics(self) -> typing.Dict[str, typing.Any]:
+        """A snapshot of the protocol metrics, cheap enough to be pulled by status pages"""
+        metrics = self.metrics
+        metrics.update_rates(base.loop.time())
+        return {
+            'round_trip_times': {kind: histogram.as_dict() for kind, histogram in metrics.round_trip_times.items()},
+            'retransmission_timeout': self.scheduler.round_trip.rto,
+            'outstanding_requests': len(self.correlation),
+            'pending_commands': len(self.scheduler),
+            'priorities': {priority.name: statistics.as_dict() for priority, statistics in self.scheduler.statistics.items()},
+            'naks': metrics.naks,
+            'uncaught_naks': metrics.uncaught_naks,
+            'timeouts': self.scheduler.timed_out_commands,
+            'retransmissions': self.scheduler.retransmitted_commands,
+            'coalesced_commands': self.scheduler.coalesced_commands,
+            'invalid_lines': metrics.invalid_lines,
+            'push_lines': metrics.push_lines,
+            'push_lines_per_second': metrics.push_lines_per_second,
+            'coalesced_push_updates': self.coalesced_push_updates,
+            'push_active': self.push_active,
+            'bytes_in': metrics.bytes_in,
+            'bytes_out': metrics.bytes_out,
+            'datagrams_in': metrics.datagrams_in,
+            'datagrams_out': metrics.datagrams_out,
+        }
+
+    def write_command(self, data: str, callback_obj: SymNetRawProtocolCallback,
+                      priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        """Send a command which is answered by ACK or NAK"""
+        return self.scheduler.schedule_command(data, callback_obj, priority)
+
+    def write_controller_value(self, controller_number: int, controller_value: int, callback_obj: SymNetRawProtocolCallback,
+                               priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        """Send a CS command for the given controller, superseding a pending one for the same controller"""
+        return self.scheduler.schedule_controller_value(controller_number, controller_value, callback_obj, priority)
+
+    def write_value_request(self, controller_number: int, callback_obj: SymNetRawProtocolCallback,
+                            priority: SymNetPriority = SymNetPriority.INTERACTIVE) -> SymNetRawProtocolCallback:
+        """Send a GS2 request for the given controller"""
+        return self.scheduler.schedule_value_request(controller_number, callback_obj, priority)
+
+    def write_value_requests(self, requests: typing.Iterable[typing.Tuple[int, SymNetRawProtocolCallback]],
+                             priority: SymNetPriority = SymNetPriority.BACKGROUND) -> typing.List[SymNetRawProtocolCallback]:
+        """Send pipelined GS2 requests for many controllers, packed into as few datagrams as possible"""
+        return [self.scheduler.schedule_value_request(controller_number, callback_obj, priority)
+                for controller_number, callback_obj in requests]
+
+
+class SymNetStreamProtocol(SymNetRawProtocol, asyncio.Protocol):
+    """
+    SymNet over a byte stream, used for TCP and RS-232 connections.
+
+    Received data is framed on carriage returns, the complete lines are processed like a datagram.
+    The protocol instance outlives its connections, so outstanding requests survive a reconnect.
+    """
+    max_buffer_size = 65536  # in bytes, an incomplete line growing beyond is discarded
+
+    def __init__(self, push_callback: typing.Callable[[typing.Dict[int, int]], typing.Any]):
+        super().__init__(push_callback)
+        self._buffer = bytearray()
+        self._closed = None  # type: typing.Optional[asyncio.Future]
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        super().connection_made(transport)
+        self._buffer.clear()
+        self._closed = base.loop.create_future()
+
+    def connection_lost(self, exc):
+        logger.warning('connection lost %s', exc)
+        self.transport = None
+        # a new connection starts without push enabled
+        self.push_active = False
+        if self._closed is not None and not self._closed.done():
+            self._closed.set_result(None)
+
+    async def wait_closed(self):
+        if self._closed is not None:
+            await asyncio.shield(self._closed, loop=base.loop)
+
+    def data_received(self, data: bytes):
+        self.metrics.bytes_in += len(data)
+        self._buffer += data
+        end = self._buffer.rfind(b'\r')
+        if end < 0:
+            if len(self._buffer) > self.max_buffer_size:
+                logger.error('discard %d bytes without a line end', len(self._buffer))
+                self._buffer.clear()
+            return
+        if end + 1 == len(self._buffer):
+            # the usual case, the received data ends on a line end: hand the buffer over as it is
+            lines, self._buffer = self._buffer, bytearray()
+        else:
+            lines = self._buffer[:end + 1]
+            del self._buffer[:end + 1]
+        self._process_lines(lines)
+
+    def write(self, data: str):
+        if self.transport is None:
+            logger.warning('not connected - drop %r, it will be retransmitted', data)
+            return
+        logger.debug('send data to symnet %s', data)
+        self.metrics.bytes_out += len(data)
+        self.transport.write(data.encode())
+
+
+class SymNetControllerObserver:
+    """
+    Notifies an observer callback about value changes of a controller.
+
+    Changes are coalesced: at most one notification is pending, carrying the old value of the first and the
+    new value of the latest change. Notifications are at least min_interval seconds apart.
+    Synchronous callbacks are called directly, coroutine functions are scheduled as a task.
+    """
+
+    def __init__(self, callback: typing.Callable, min_interval: float = 0.0, synchronous: bool = False):
+        self.callback = callback
+        self.min_interval = float(min_interval)
+        self.synchronous = synchronous
+
+        self._pending = False
+        self._old_value = 0
+        self._new_value = 0
+        self._last_notification = None  # type: typing.Optional[float]
+
+    def notify(self, controller: 'SymNetController', old_value: int, new_value: int):
+        if self._pending:
+            self._new_value = new_value
+            return
+        self._pending = True
+        self._old_value = old_value
+        self._new_value = new_value
+
+        delay = 0.0
+        if self._last_notification is not None:
+            delay = self._last_notification + self.min_interval - base.loop.time()
+        if delay > 0:
+            base.loop.call_later(delay, self._deliver, controller)
+        else:
+            base.loop.call_soon(self._deliver, controller)
+
+    def _deliver(self, controller: 'SymNetController'):
+        self._pending = False
+        if self._old_value == self._new_value:
+            return  # changed back and forth in the meantime
+        self._last_notification = base.loop.time()
+        if self.synchronous:
+            self.callback(controller, old_value=self._old_value, new_value=self._new_value)
+        else:
+            base.loop.create_task(self.callback(controller, old_value=self._old_value, new_value=self._new_value))
 
-class SymNetController:
-    value_timeout = 10  # in seconds
 
-    def __init__(self, controller_number: int, protocol: SymNetRawProtocol):
-        logger.debug('create new SymNetController with %d', controller_number)
+class SymNetControllerBase:
+    """
+    A controller of the device, its value, value time and observers are kept by the subclass.
+
+    SymNetController keeps them in slots, the registry views in the SymNetControllerRegistry of the protocol.
+    """
+    __slots__ = ('controller_number', 'proto')
+    default_value_timeout = 10  # in seconds, the value_timeout of new controllers
+
+    raw_value = ...  # type: int
+    raw_value_time = ...  # type: float
+    observer = ...  # type: typing.List[SymNetControllerObserver]
+    # cached values older than this are read from the device while push is inactive
+    value_timeout = ...  # type: float
+
+    def __init__(self, controller_number: int, protocol: SymNetRawProtocol, retrieve_state: bool = True):
+        logger.debug('create new %s with %d', type(self).__name__, controller_number)
         self.controller_number = int(controller_number)
         self.proto = protocol
+        self._initialize_value()
 
-        self.raw_value = 0
-        self.raw_value_time = 0
+        if retrieve_state:
+            base.loop.run_until_complete(self._retrieve_current_state().future)
 
-        self.observer = []  # type: typing.List[typing.Callable]
+    def _initialize_value(self):
+        raise NotImplementedError()
 
-        base.loop.run_until_complete(self._retrieve_current_state().future)
+    @classmethod
+    async def create(cls, *args, **kwargs) -> 'SymNetControllerBase':
+        """Create a controller and retrieve its current state without blocking the running loop"""
+        controller = cls(*args, retrieve_state=False, **kwargs)
+        await controller._retrieve_current_state().future
+        return controller
+
+    def add_observer(self, callback: typing.Callable, min_interval: float = 0.0, synchronous: bool = False):
+        """
+        Call callback(controller, old_value=..., new_value=...) on value changes, see SymNetControllerObserver.
 
-    def add_observer(self, callback: typing.Callable):
+        callback has to be a coroutine function unless synchronous is set.
+        """
         logger.debug("add a observer (%s) to controller %d", callback, self.controller_number)
-        return self.observer.append(callback)
+        return self.observer.append(SymNetControllerObserver(callback, min_interval=min_interval, synchronous=synchronous))
 
     def remove_observer(self, callback: typing.Callable):
         logger.debug("remove a observer (%s) to controller %d", callback, self.controller_number)
-        return self.observer.remove(callback)
+        self.observer = [observer for observer in self.observer if observer.callback != callback]
 
     async def _get_raw_value(self) -> int:
         logger.debug('retrieve current value for controller %d', self.controller_number)
-        if base.loop.time() - self.raw_value_time > self.value_timeout:
+        if not self.proto.push_active and base.loop.time() - self.raw_value_time > self.value_timeout:
             logger.debug('value timeout - refresh')
             await self._retrieve_current_state().future
         return self.raw_value
@@ -134,60 +861,97 @@ class SymNetController:
         self.raw_value_time = base.loop.time()
         if old_value != value:
             logger.debug("value has changed - notify observers")
-            for clb in self.observer:
-                base.loop.create_task(clb(self, old_value=old_value, new_value=value))
+            for observer in self.observer:
+                observer.notify(self, old_value, value)
 
-    def _assure_current_state(self):
+    def _assure_current_state(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
         logger.debug("assure current controller %d state to set on the symnet device", self.controller_number)
-        callback_obj = SymNetRawProtocolCallback(
-            callback=self._assure_callback,
-            expected_lines=1,
-            regex='^(ACK)|(NAK)\r$'
+        return self.proto.write_controller_value(
+            self.controller_number,
+            self.raw_value,
+            SymNetRawProtocolCallback(callback=self._assure_callback),
+            priority
         )
-        self.proto.callback_queue.append(callback_obj)
-        self.proto.write('CS {cn:d} {cv:d}\r'.format(cn=self.controller_number, cv=self.raw_value))
-        return callback_obj
 
-    def _assure_callback(self, _, m=None):
-        if m is None or m.group(1) == 'NAK':
+    def _assure_callback(self, acknowledged: typing.Optional[bool]):
+        if not acknowledged:
             raise Exception(
                 'Unknown error occurred awaiting the acknowledge of setting controller number {:d}'.format(
                     self.controller_number))
 
-    def _retrieve_current_state(self):
+    def _retrieve_current_state(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
         logger.debug("request current value from the symnet device for controller %d", self.controller_number)
-        callback_obj = SymNetRawProtocolCallback(
-            callback=self._retrieve_callback,
-            expected_lines=1,
-            regex='^' + str(self.controller_number) + ' ([0-9]{1,5})\r$'
+        return self.proto.write_value_request(
+            self.controller_number,
+            SymNetRawProtocolCallback(callback=self._retrieve_callback),
+            priority
         )
-        self.proto.callback_queue.append(callback_obj)
-        self.proto.write('GS2 {:d}\r'.format(self.controller_number))
-        return callback_obj
 
-    def _retrieve_callback(self, _, m=None):
-        if m is None:
+    def _retrieve_callback(self, controller_value: typing.Optional[int]):
+        if controller_value is None:
             raise Exception('Error executing GS2 command, controller {}'.format(self.controller_number))
-        self._set_raw_value(int(m.group(1)))
+        self._set_raw_value(controller_value)
+
 
+class SymNetSelectorControllerBase(SymNetControllerBase):
+    __slots__ = ()
 
-class SymNetSelectorController(SymNetController):
-    def __init__(self, controller_number: int, position_cont: int, protocol: SymNetRawProtocol):
-        super().__init__(controller_number, protocol)
+    _position_count = ...  # type: int
 
+    def __init__(self, controller_number: int, position_cont: int, protocol: SymNetRawProtocol, retrieve_state: bool = True):
         self._position_count = int(position_cont)
+        super().__init__(controller_number, protocol, retrieve_state=retrieve_state)
 
     @property
     def position_count(self) -> int:
         return self._position_count
 
+    def position_to_raw_value(self, position: int) -> int:
+        assert 1 <= position <= self.position_count
+        return int(round((position - 1) / (self.position_count - 1) * 65535))
+
     async def get_position(self):
         return int(round(await self._get_raw_value() / 65535 * (self.position_count - 1) + 1))
 
-    async def set_position(self, position: int):
-        assert 1 <= position <= self.position_count
-        self._set_raw_value(int(round((position - 1) / (self.position_count - 1) * 65535)))
-        await self._assure_current_state().future
+    async def set_position(self, position: int, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        self._set_raw_value(self.position_to_raw_value(position))
+        await self._assure_current_state(priority).future
+
+
+class SymNetButtonControllerBase(SymNetControllerBase):
+    __slots__ = ()
+
+    async def on(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        self._set_raw_value(65535)
+        await self._assure_current_state(priority).future
+
+    async def off(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        self._set_raw_value(0)
+        await self._assure_current_state(priority).future
+
+    async def pressed(self):
+        return await self._get_raw_value() > 0
+
+    def set(self, state: bool, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        if state:
+            return self.on(priority)
+        else:
+            return self.off(priority)
+
+
+class SymNetController(SymNetControllerBase):
+    __slots__ = ('raw_value', 'raw_value_time', 'observer', 'value_timeout')
+
+    def _initialize_value(self):
+        self.raw_value = 0
+        self.raw_value_time = 0
+        self.value_timeout = self.default_value_timeout
+
+        self.observer = []  # type: typing.List[SymNetControllerObserver]
+
+
+class SymNetSelectorController(SymNetSelectorControllerBase, SymNetController):
+    __slots__ = ('_position_count',)
 
 
 class SymNetSelectorControllerDummy(SymNetSelectorController):
@@ -199,136 +963,693 @@ class SymNetSelectorControllerDummy(SymNetSelectorController):
         self.raw_value = 0
         self.raw_value_time = 0
 
-        self.observer = []  # type: typing.List[typing.Callable]
-
-    def add_observer(self, callback: typing.Callable):
-        logger.debug("add a observer (%s) to controller %d", callback, self.controller_number)
-        return self.observer.append(callback)
-
-    def remove_observer(self, callback: typing.Callable):
-        logger.debug("remove a observer (%s) to controller %d", callback, self.controller_number)
-        return self.observer.remove(callback)
+        self.observer = []  # type: typing.List[SymNetControllerObserver]
 
     async def _get_raw_value(self) -> int:
         logger.debug('retrieve current value for controller %d', self.controller_number)
         return self.raw_value
 
-    def _set_raw_value(self, value: int):
-        logger.debug('set_raw_value called on %d with %d', self.controller_number, value)
-        old_value = self.raw_value
-        self.raw_value = value
-        self.raw_value_time = base.loop.time()
-        if old_value != value:
-            logger.debug("value has changed - notify observers")
-            for clb in self.observer:
-                base.loop.create_task(clb(self, old_value=old_value, new_value=value))
-
-    def _assure_current_state(self):
+    def _assure_current_state(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
         raise NotImplementedError("Dummy implementation")
 
-    def _assure_callback(self, _, m=None):
+    def _assure_callback(self, acknowledged: typing.Optional[bool]):
         raise NotImplementedError("Dummy implementation")
 
-    def _retrieve_current_state(self):
+    def _retrieve_current_state(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
         logger.debug("request current value from the symnet device for controller %d", self.controller_number)
-        callback_obj = SymNetRawProtocolCallback(
-            callback=self._retrieve_callback,
-            expected_lines=1,
-            regex='^' + str(self.controller_number) + ' ([0-9]{1,5})\r$'
+        return self.proto.write_value_request(
+            self.controller_number,
+            SymNetRawProtocolCallback(callback=self._retrieve_callback),
+            priority
         )
-        self.proto.callback_queue.append(callback_obj)
-        self.proto.write('GS2 {:d}\r'.format(self.controller_number))
-        return callback_obj
 
-    def _retrieve_callback(self, _, m=None):
-        if m is None:
+    def _retrieve_callback(self, controller_value: typing.Optional[int]):
+        if controller_value is None:
             raise Exception('Error executing GS2 command, controller {}'.format(self.controller_number))
-        self._set_raw_value(int(m.group(1)))
+        self._set_raw_value(controller_value)
 
     async def get_position(self):
         return int(round(await self._get_raw_value() / 65535 * (self.position_count - 1) + 1))
 
-    async def set_position(self, position: int):
-        assert 1 <= position <= self.position_count
-        self._set_raw_value(int(round((position - 1) / (self.position_count - 1) * 65535)))
+    async def set_position(self, position: int, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        self._set_raw_value(self.position_to_raw_value(position))
+
+
+class SymNetButtonController(SymNetButtonControllerBase, SymNetController):
+    __slots__ = ()
+
+
+class SymNetControllerRegistry:
+    """
+    Stores the values and value times of many controllers in typed arrays indexed by the controller number.
+
+    Controllers using the registry are SymNetRegistryView objects, which only hold their number and protocol.
+    Observer lists are only kept for controllers having observers, all views share the value_timeout.
+    """
+
+    def __init__(self):
+        self.values = array.array('i')
+        self.value_times = array.array('d')
+        self.observers = {}  # type: typing.Dict[int, typing.List[SymNetControllerObserver]]
+        self.value_timeout = SymNetControllerBase.default_value_timeout
+
+    def reserve(self, controller_number: int):
+        missing = controller_number + 1 - len(self.values)
+        if missing > 0:
+            self.values.extend(itertools.repeat(0, missing))
+            self.value_times.extend(itertools.repeat(0.0, missing))
+
+    def set_value(self, controller: 'SymNetRegistryView', controller_value: int, now: float):
+        controller_number = controller.controller_number
+        old_value = self.values[controller_number]
+        self.values[controller_number] = controller_value
+        self.value_times[controller_number] = now
+        if old_value != controller_value:
+            observers = self.observers.get(controller_number)
+            if observers:
+                for observer in observers:
+                    observer.notify(controller, old_value, controller_value)
+
+    def apply(self, updates: typing.Dict[int, int], controllers: typing.Dict[int, SymNetControllerBase]) -> int:
+        """
+        Write a batch of values straight into the arrays, returns the number of values for undefined controllers.
+
+        Controllers defined before the registry was used keep their own value and are updated one by one.
+        """
+        now = base.loop.time()
+        dropped = 0
+        for controller_number, controller_value in updates.items():
+            controller = controllers.get(controller_number)
+            if controller is None:
+                dropped += 1
+            elif isinstance(controller, SymNetRegistryView):
+                self.set_value(controller, controller_value, now)
+            else:
+                # noinspection PyProtectedMember
+                controller._set_raw_value(controller_value)
+        return dropped
 
 
-class SymNetButtonController(SymNetController):
-    async def on(self):
-        self._set_raw_value(65535)
-        await self._assure_current_state().future
+class SymNetRegistryView(SymNetControllerBase):
+    """Keeps the value, value time and observers of a controller in the registry of its protocol"""
+    __slots__ = ()
 
-    async def off(self):
-        self._set_raw_value(0)
-        await self._assure_current_state().future
+    def _initialize_value(self):
+        self.proto.registry.reserve(self.controller_number)
 
-    async def pressed(self):
-        return await self._get_raw_value() > 0
+    @property
+    def raw_value(self) -> int:
+        return self.proto.registry.values[self.controller_number]
 
-    def set(self, state: bool):
-        if state:
-            return self.on()
+    @property
+    def raw_value_time(self) -> float:
+        return self.proto.registry.value_times[self.controller_number]
+
+    @property
+    def value_timeout(self) -> float:
+        return self.proto.registry.value_timeout
+
+    @property
+    def observer(self) -> typing.List[SymNetControllerObserver]:
+        return self.proto.registry.observers.get(self.controller_number, [])
+
+    @observer.setter
+    def observer(self, observers: typing.List[SymNetControllerObserver]):
+        if observers:
+            self.proto.registry.observers[self.controller_number] = observers
         else:
-            return self.off()
+            self.proto.registry.observers.pop(self.controller_number, None)
+
+    def add_observer(self, callback: typing.Callable, min_interval: float = 0.0, synchronous: bool = False):
+        self.proto.registry.observers.setdefault(self.controller_number, [])
+        return super().add_observer(callback, min_interval=min_interval, synchronous=synchronous)
+
+    def _set_raw_value(self, value: int):
+        self.proto.registry.set_value(self, value, base.loop.time())
+
+
+class SymNetControllerView(SymNetRegistryView):
+    __slots__ = ()
+
+
+class SymNetSelectorControllerView(SymNetSelectorControllerBase, SymNetRegistryView):
+    __slots__ = ('_position_count',)
+
+
+class SymNetButtonControllerView(SymNetButtonControllerBase, SymNetRegistryView):
+    __slots__ = ()
+
+
+class SymNetScene:
+    """
+    A set of controller values applied in one burst.
+
+    All CS commands of a scene are issued within the same loop iteration, so the scheduler packs them into as
+    few datagrams as the datagram size allows and observers see the scene as one change.
+    """
+
+    def __init__(self, values: typing.Dict[SymNetControllerBase, int] = None):
+        self.values = dict(values) if values else {}  # type: typing.Dict[SymNetControllerBase, int]
+
+    def set_raw_value(self, controller: SymNetControllerBase, value: int) -> 'SymNetScene':
+        assert 0 <= value <= 65535
+        self.values[controller] = int(value)
+        return self
+
+    def set_position(self, selector: SymNetSelectorController, position: int) -> 'SymNetScene':
+        return self.set_raw_value(selector, selector.position_to_raw_value(position))
+
+    def set_button(self, button: SymNetButtonController, state: bool) -> 'SymNetScene':
+        return self.set_raw_value(button, 65535 if state else 0)
+
+    async def apply(self, priority: SymNetPriority = SymNetPriority.INTERACTIVE):
+        callback_objs = []
+        # noinspection PyProtectedMember
+        for controller, value in self.values.items():
+            controller._set_raw_value(value)
+            callback_objs.append(controller._assure_current_state(priority))
+        await asyncio.gather(*[callback_obj.future for callback_obj in callback_objs], loop=base.loop)
 
 
 class SymNetDevice:
-    controllers = ...  # type: typing.Dict[int, SymNetController]
+    controllers = ...  # type: typing.Dict[int, SymNetControllerBase]
+    reconnect_delay = 1  # in seconds, doubled on every failed attempt
+    max_reconnect_delay = 30  # in seconds
+    snapshot_max_age = 3600  # in seconds, older snapshot values aren't used for a warm start
 
     def __init__(self, local_address: typing.Tuple[str, int], remote_address: typing.Tuple[str, int]):
-        self._state_queue = asyncio.Queue(loop=base.loop)
+        self._prepare()
+        base.loop.run_until_complete(self._connect(local_address, remote_address))
+
+    @classmethod
+    async def connect(cls, local_address: typing.Tuple[str, int], remote_address: typing.Tuple[str, int]) -> 'SymNetDevice':
+        """Create a device from within a running loop"""
+        device = cls.__new__(cls)
+        device._prepare()
+        await device._connect(local_address, remote_address)
+        return device
+
+    @classmethod
+    async def connect_tcp(cls, host: str, port: int = 48631) -> 'SymNetDevice':
+        """Create a device reached over a persistent TCP connection, which is reestablished if lost"""
+        device = cls.__new__(cls)
+        device._prepare()
+        device.protocol = SymNetStreamProtocol(push_callback=device._apply_push_updates)
+
+        async def open_connection():
+            await base.loop.create_connection(lambda: device.protocol, host, port)
+
+        await device._connect_stream(open_connection)
+        return device
+
+    @classmethod
+    async def connect_serial(cls, url: str, baudrate: int = 38400, **kwargs) -> 'SymNetDevice':
+        """
+        Create a device reached over RS-232, url and kwargs are handed to pyserial.
+
+        This requires the optional pyserial-asyncio package, see requirements-serial.txt.
+        """
+        try:
+            import serial_asyncio
+        except ImportError:
+            raise ImportError('SymNet over RS-232 requires the optional pyserial-asyncio package, '
+                              'install it with: pip install -r requirements-serial.txt')
 
-        def create_protocol() -> asyncio.DatagramProtocol:
-            return SymNetRawProtocol(state_queue=self._state_queue)
+        device = cls.__new__(cls)
+        device._prepare()
+        device.protocol = SymNetStreamProtocol(push_callback=device._apply_push_updates)
+
+        async def open_connection():
+            await serial_asyncio.create_serial_connection(base.loop, lambda: device.protocol, url, baudrate=baudrate, **kwargs)
+
+        await device._connect_stream(open_connection)
+        return device
+
+    @property
+    def transport(self) -> typing.Optional[asyncio.BaseTransport]:
+        return self.protocol.transport if self.protocol else None
 
+    def _prepare(self):
         logger.debug('setup new symnet device')
         self.controllers = {}
-        connect = base.loop.create_datagram_endpoint(
+        self.protocol = None  # type: typing.Optional[SymNetRawProtocol]
+        # pushed updates for controllers which aren't defined on this device
+        self.dropped_push_updates = 0
+        # called with every batch of pushed values, including those of undefined controllers like meters
+        self.push_listeners = []  # type: typing.List[typing.Callable[[typing.Dict[int, int]], typing.Any]]
+        self._subscription_task = None  # type: typing.Optional[asyncio.Task]
+        self._connection_task = None  # type: typing.Optional[asyncio.Task]
+        self.snapshot_path = None  # type: typing.Optional[str]
+        self._snapshot = {}  # type: typing.Dict[int, typing.Tuple[int, float]]
+        # restored controllers not confirmed by the device yet: loop time of the restore, time of the snapshot value
+        self._snapshot_unverified = {}  # type: typing.Dict[int, typing.Tuple[float, float]]
+        self._snapshot_task = None  # type: typing.Optional[asyncio.Task]
+        self._snapshot_lock = threading.Lock()
+        self._snapshot_generation = 0
+        self._snapshot_written = 0
+
+    async def _connect(self, local_address: typing.Tuple[str, int], remote_address: typing.Tuple[str, int]):
+        def create_protocol() -> asyncio.DatagramProtocol:
+            return SymNetRawProtocol(push_callback=self._apply_push_updates)
+
+        _, self.protocol = await base.loop.create_datagram_endpoint(
             create_protocol,
             local_addr=local_address,
             remote_addr=remote_address
         )
-        self.transport, self.protocol = base.loop.run_until_complete(connect)
 
-        self._process_task = base.loop.create_task(self._process_push_messages())
         base.cleanup_tasks.append(base.loop.create_task(self._cleanup()))
 
-    async def _process_push_messages(self):
+    async def _connect_stream(self, open_connection: typing.Callable[[], typing.Awaitable]):
+        await open_connection()
+        self._connection_task = base.loop.create_task(self._maintain_connection(open_connection))
+        base.cleanup_tasks.append(base.loop.create_task(self._cleanup()))
+
+    async def _maintain_connection(self, open_connection: typing.Callable[[], typing.Awaitable]):
         while True:
-            cs = await self._state_queue.get()  # type: SymNetRawControllerState
-            logger.debug("received some pushed data - handover to the controller object")
-            if cs.controller_number in self.controllers:
-                # noinspection PyProtectedMember
-                self.controllers[cs.controller_number]._set_raw_value(cs.controller_value)
+            await self.protocol.wait_closed()
+            delay = self.reconnect_delay
+            while True:
+                logger.info('reconnect to the symnet device in %s seconds', delay)
+                await asyncio.sleep(delay, loop=base.loop)
+                try:
+                    await open_connection()
+                    break
+                except OSError as e:
+                    logger.error('reconnect failed: %s', e)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _apply_push_updates(self, updates: typing.Dict[int, int]):
+        logger.debug("received %d pushed values - handover to the controller objects", len(updates))
+        for listener in self.push_listeners:
+            listener(updates)
+        if self.protocol.registry is not None:
+            self.dropped_push_updates += self.protocol.registry.apply(updates, self.controllers)
+            return
+        for controller_number, controller_value in updates.items():
+            controller = self.controllers.get(controller_number)
+            if controller is None:
+                self.dropped_push_updates += 1
+                continue
+            # noinspection PyProtectedMember
+            controller._set_raw_value(controller_value)
+
+    def use_registry(self):
+        """
+        Keep the values of controllers defined from now on in a compact SymNetControllerRegistry.
+
+        Intended for large installations, the controllers are view objects over typed arrays.
+        """
+        if self.protocol.registry is None:
+            self.protocol.registry = SymNetControllerRegistry()
+
+    def _controller_class(self, controller_class: typing.Type[SymNetControllerBase]) -> typing.Type[SymNetControllerBase]:
+        if self.protocol.registry is None:
+            return controller_class
+        return {
+            SymNetController: SymNetControllerView,
+            SymNetSelectorController: SymNetSelectorControllerView,
+            SymNetButtonController: SymNetButtonControllerView,
+        }[controller_class]
+
+    async def _register(self, controller: SymNetControllerBase) -> SymNetControllerBase:
+        self.controllers[controller.controller_number] = controller
+        if self._restore_from_snapshot([controller]):
+            return controller
+        # noinspection PyProtectedMember
+        await controller._retrieve_current_state().future
+        return controller
 
-    def define_controller(self, controller_number: int) -> SymNetController:
-        logger.debug('create new controller %d on symnet device', controller_number)
-        controller_number = int(controller_number)
-        controller = SymNetController(controller_number, self.protocol)
-        self.controllers[controller_number] = controller
+    def define_controller(self, controller_number: int) -> SymNetControllerBase:
+        return base.loop.run_until_complete(self.define_controller_async(controller_number))
 
-        return controller
+    def define_selector(self, controller_number: int, position_count: int) -> SymNetSelectorControllerBase:
+        return base.loop.run_until_complete(self.define_selector_async(controller_number, position_count))
 
-    def define_selector(self, controller_number: int, position_count: int) -> SymNetSelectorController:
-        logger.debug('create new selector %d on symnet device', controller_number)
-        controller_number = int(controller_number)
-        controller = SymNetSelectorController(controller_number, position_count, self.protocol)
-        self.controllers[controller_number] = controller
+    def define_button(self, controller_number: int) -> SymNetButtonControllerBase:
+        return base.loop.run_until_complete(self.define_button_async(controller_number))
 
-        return controller
+    async def define_controller_async(self, controller_number: int) -> SymNetControllerBase:
+        logger.debug('create new controller %d on symnet device', controller_number)
+        controller_class = self._controller_class(SymNetController)
+        return await self._register(controller_class(int(controller_number), self.protocol, retrieve_state=False))
+
+    async def define_selector_async(self, controller_number: int, position_count: int) -> SymNetSelectorControllerBase:
+        logger.debug('create new selector %d on symnet device', controller_number)
+        controller_class = self._controller_class(SymNetSelectorController)
+        return await self._register(controller_class(int(controller_number), position_count, self.protocol, retrieve_state=False))
 
-    def define_button(self, controller_number: int) -> SymNetButtonController:
+    async def define_button_async(self, controller_number: int) -> SymNetButtonControllerBase:
         logger.debug('create new button %d on symnet device', controller_number)
-        controller_number = int(controller_number)
-        controller = SymNetButtonController(controller_number, self.protocol)
-        self.controllers[controller_number] = controller
+        controller_class = self._controller_class(SymNetButtonController)
+        return await self._register(controller_class(int(controller_number), self.protocol, retrieve_state=False))
+
+    async def define_bulk(self,
+                          controllers: typing.Iterable[int] = (),
+                          selectors: typing.Iterable[typing.Tuple[int, int]] = (),
+                          buttons: typing.Iterable[int] = ()
+                          ) -> typing.Dict[int, SymNetControllerBase]:
+        """
+        Define many controllers at once and fetch their current values with pipelined GS2 requests.
+
+        selectors is an iterable of (controller_number, position_count) pairs.
+        The startup time depends on the number of datagrams instead of the number of round trips.
+        """
+        controller_class = self._controller_class(SymNetController)
+        selector_class = self._controller_class(SymNetSelectorController)
+        button_class = self._controller_class(SymNetButtonController)
+        defined = {}  # type: typing.Dict[int, SymNetControllerBase]
+        for controller_number in controllers:
+            controller_number = int(controller_number)
+            defined[controller_number] = controller_class(controller_number, self.protocol, retrieve_state=False)
+        for controller_number, position_count in selectors:
+            controller_number = int(controller_number)
+            defined[controller_number] = selector_class(controller_number, position_count, self.protocol, retrieve_state=False)
+        for controller_number in buttons:
+            controller_number = int(controller_number)
+            defined[controller_number] = button_class(controller_number, self.protocol, retrieve_state=False)
+        logger.debug('define %d controllers in bulk on symnet device', len(defined))
+
+        self.controllers.update(defined)
+        restored = set(self._restore_from_snapshot(defined.values()))
+        await self.retrieve_current_states([controller for controller in defined.values() if controller not in restored])
+
+        return defined
+
+    async def retrieve_current_states(self, controllers: typing.Iterable[SymNetControllerBase] = None,
+                                      priority: SymNetPriority = SymNetPriority.BACKGROUND,
+                                      return_exceptions: bool = False) -> typing.List[typing.Any]:
+        """
+        Refresh the values of the given controllers, all defined controllers if None, with pipelined GS2 requests.
+
+        With return_exceptions the failures of single controllers are returned instead of raised, like by gather.
+        """
+        if controllers is None:
+            controllers = list(self.controllers.values())
+        # noinspection PyProtectedMember
+        callback_objs = self.protocol.write_value_requests(
+            ((controller.controller_number, SymNetRawProtocolCallback(callback=controller._retrieve_callback))
+             for controller in controllers),
+            priority
+        )
+        return await asyncio.gather(*[callback_obj.future for callback_obj in callback_objs], loop=base.loop,
+                                    return_exceptions=return_exceptions)
+
+    async def recall_preset(self, preset_number: int, controllers: typing.Iterable[SymNetControllerBase] = None,
+                            priority: SymNetPriority = SymNetPriority.ON_AIR):
+        """
+        Load a preset on the device and refresh the cached values of the affected controllers afterwards.
+
+        All defined controllers are refreshed if controllers is None. The refreshed values are applied within
+        one batch, so every observer is notified once.
+        """
+        logger.debug('recall preset %d', preset_number)
+        await self.protocol.write_command(
+            'LP {:d}\r'.format(preset_number),
+            SymNetRawProtocolCallback(callback=self._acknowledge_callback),
+            priority
+        ).future
+        await self.retrieve_current_states(controllers, SymNetPriority.INTERACTIVE)
+
+    def subscribe(self, probe_interval: float = 5.0, refresh_interval: float = 60.0):
+        """
+        Let the device push all value changes and serve controller values from the cache without polling.
+
+        Push is enabled again every probe_interval seconds, so a device that lost its subscribers on a reboot
+        pushes again. If the device doesn't answer, controllers fall back to polling until push could be enabled
+        again. Changes missed meanwhile are caught by a full refresh once push is back, and by a full refresh in
+        the background every refresh_interval seconds, reads never wait for the device while push is active.
+        """
+        if self._subscription_task is None:
+            self._subscription_task = base.loop.create_task(self._subscription_loop(probe_interval, refresh_interval))
+
+    @staticmethod
+    def _acknowledge_callback(acknowledged: typing.Optional[bool]):
+        if not acknowledged:
+            raise Exception('The SymNet device did not acknowledge the command')
+
+    async def _refresh_all(self, reason: str):
+        failures = [result for result in await self.retrieve_current_states(return_exceptions=True)
+                    if isinstance(result, Exception)]
+        if failures:
+            # these controllers are refreshed again by the next periodic refresh
+            logger.warning('could not refresh %d controllers %s: %s', len(failures), reason, failures[0])
+
+    async def _subscription_loop(self, probe_interval: float, refresh_interval: float):
+        last_refresh = base.loop.time()
+        while True:
+            try:
+                await self.protocol.write_command('PU 1\r', SymNetRawProtocolCallback(callback=self._acknowledge_callback)).future
+                if not self.protocol.push_active:
+                    logger.debug('push enabled on the symnet device')
+                    # changes happened while push was lost are only visible after a refresh
+                    last_refresh = base.loop.time()
+                    await self._refresh_all('after enabling push')
+                    self.protocol.push_active = True
+                elif base.loop.time() - last_refresh >= refresh_interval:
+                    # catches changes missed while the device lost the subscription unnoticed
+                    last_refresh = base.loop.time()
+                    await self._refresh_all('in the periodic refresh')
+            except Exception as e:
+                if self.protocol.push_active:
+                    logger.error('push channel lost, fall back to polling: %s', e)
+                self.protocol.push_active = False
+            await asyncio.sleep(probe_interval, loop=base.loop)
+
+    def use_snapshot(self, file_path: str, interval: float = 60.0):
+        """
+        Warm start from a snapshot of the controller values and keep it up to date.
+
+        Controllers defined afterwards take their value from the snapshot and are ready immediately,
+        the values are verified against the device in the background.
+        The snapshot is written every interval seconds and when the device is closed.
+        """
+        self.snapshot_path = file_path
+        self._snapshot = self._read_snapshot(file_path)
+        if self._snapshot_task is None:
+            self._snapshot_task = base.loop.create_task(self._snapshot_loop(interval))
+
+    def _read_snapshot(self, file_path: str) -> typing.Dict[int, typing.Tuple[int, float]]:
+        try:
+            with open(file_path, 'r') as fp:
+                snapshot = json.load(fp)
+        except IOError as e:
+            if e.errno == 2:
+                logger.warning('Could not load snapshot: %s', e)
+            else:
+                logger.critical('Could not load snapshot: %s', e)
+            return {}
+        except ValueError as e:
+            logger.critical('Could not load snapshot: %s', e)
+            return {}
+
+        min_time = time.time() - self.snapshot_max_age
+        values = {}
+        try:
+            entries = snapshot['controllers']
+            for controller_number, controller_value, value_time in entries:
+                if not isinstance(controller_number, int) or not isinstance(controller_value, int) \
+                        or not isinstance(value_time, (int, float)):
+                    raise TypeError('invalid controller entry {!r}'.format([controller_number, controller_value, value_time]))
+                if value_time >= min_time:
+                    values[controller_number] = (controller_value, value_time)
+        except (KeyError, TypeError, ValueError) as e:
+            logger.critical('Invalid snapshot, read all controller values from the device: %s', e)
+            return {}
+        logger.debug('loaded %d of %d controller values from snapshot', len(values), len(entries))
+        return values
+
+    def _snapshot_entries(self) -> typing.List[typing.List]:
+        time_offset = time.time() - base.loop.time()
+        entries = []
+        for controller in self.controllers.values():
+            if not controller.raw_value_time:
+                continue
+            value_time = controller.raw_value_time + time_offset
+            unverified = self._snapshot_unverified.get(controller.controller_number)
+            if unverified is not None:
+                restore_time, snapshot_time = unverified
+                if controller.raw_value_time <= restore_time:
+                    # not confirmed by the device yet, the value keeps aging from the time it was read
+                    value_time = snapshot_time
+                else:
+                    del self._snapshot_unverified[controller.controller_number]
+            entries.append([controller.controller_number, controller.raw_value, round(value_time, 3)])
+        return entries
+
+    def _write_snapshot(self, file_path: str, entries: typing.List[typing.List], generation: int):
+        # the final write on close may overlap with one still running or queued in the executor, an older one is dropped
+        with self._snapshot_lock:
+            if generation < self._snapshot_written:
+                return
+            fd, temporary_path = tempfile.mkstemp(prefix=os.path.basename(file_path) + '.', suffix='.tmp',
+                                                  dir=os.path.dirname(file_path) or '.')
+            try:
+                with open(fd, 'w') as fp:
+                    os.fchmod(fd, 0o644)
+                    json.dump({'controllers': entries}, fp, separators=(',', ':'))
+                    fp.flush()
+                    os.fsync(fp.fileno())
+                os.replace(temporary_path, file_path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+            self._snapshot_written = generation
+
+    async def save_snapshot(self):
+        """Write the snapshot in the executor, the former one is replaced atomically"""
+        if self.snapshot_path is None:
+            return
+        try:
+            self._snapshot_generation += 1
+            await base.loop.run_in_executor(None, self._write_snapshot, self.snapshot_path, self._snapshot_entries(),
+                                            self._snapshot_generation)
+        except OSError as e:
+            logger.error('Could not save snapshot: %s', e)
 
-        return controller
+    async def _snapshot_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval, loop=base.loop)
+            await self.save_snapshot()
+
+    def _restore_from_snapshot(self, controllers: typing.Iterable[SymNetControllerBase]) -> typing.List[SymNetControllerBase]:
+        restored = []
+        for controller in controllers:
+            entry = self._snapshot.pop(controller.controller_number, None)
+            if entry is not None:
+                controller_value, snapshot_time = entry
+                # noinspection PyProtectedMember
+                controller._set_raw_value(controller_value)
+                self._snapshot_unverified[controller.controller_number] = (controller.raw_value_time, snapshot_time)
+                restored.append(controller)
+        if restored:
+            base.loop.create_task(self._verify_snapshot_values(restored))
+        return restored
+
+    async def _verify_snapshot_values(self, controllers: typing.List[SymNetControllerBase]):
+        try:
+            await self.retrieve_current_states(controllers)
+        except Exception as e:
+            logger.error('Could not verify the snapshot values: %s', e)
+
+    def collect_metrics(self) -> typing.Dict[str, typing.Any]:
+        """Metrics of the link to the device, see SymNetRawProtocol.collect_metrics"""
+        metrics = self.protocol.collect_metrics() if self.protocol is not None else {}
+        metrics['controllers'] = len(self.controllers)
+        metrics['dropped_push_updates'] = self.dropped_push_updates
+        return metrics
+
+    def close(self):
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        if self.snapshot_path is not None:
+            # the loop may be about to stop, the final snapshot is written right away
+            try:
+                self._snapshot_generation += 1
+                self._write_snapshot(self.snapshot_path, self._snapshot_entries(), self._snapshot_generation)
+            except OSError as e:
+                logger.error('Could not save snapshot: %s', e)
+        if self._subscription_task is not None:
+            self._subscription_task.cancel()
+        if self._connection_task is not None:
+            self._connection_task.cancel()
+        logger.debug('SymNetDevice close transport')
+        if self.transport is not None:
+            self.transport.close()
 
     async def _cleanup(self):
         logger.debug('SymNetDevice awaiting cleanup')
         await base.cleanup_event.wait()
-        logger.debug('SymNetDevice cancel process_task')
-        self._process_task.cancel()
-        logger.debug('SymNetDevice close transport')
-        self.transport.close()
+        self.close()
+
+
+class SymNetSharedTransport:
+    """The part of a datagram transport used by SymNetRawProtocol, sending to one device over a shared endpoint"""
+
+    def __init__(self, endpoint: 'SymNetSharedEndpoint', remote_address: typing.Tuple[str, int]):
+        self._endpoint = endpoint
+        self._remote_address = remote_address
+
+    def sendto(self, data: bytes, address=None):
+        self._endpoint.transport.sendto(data, self._remote_address)
+
+    def close(self):
+        self._endpoint.protocols.pop(self._remote_address, None)
+
+
+class SymNetSharedEndpoint(asyncio.DatagramProtocol):
+    """A UDP socket shared by several SymNet devices, incoming datagrams are demultiplexed by their remote address"""
+
+    def __init__(self):
+        self.transport = None  # type: typing.Optional[asyncio.DatagramTransport]
+        self.protocols = {}  # type: typing.Dict[typing.Tuple[str, int], SymNetRawProtocol]
+        self.unknown_datagrams = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address):
+        protocol = self.protocols.get(address[:2])
+        if protocol is None:
+            logger.warning('datagram from unknown address %s', address)
+            self.unknown_datagrams += 1
+            return
+        protocol.datagram_received(data, address)
+
+    def error_received(self, exc):
+        logger.error('Error received %s', exc)
+
+    def attach(self, remote_address: typing.Tuple[str, int], protocol: SymNetRawProtocol):
+        if remote_address in self.protocols:
+            raise ValueError('a device with address {} is already attached'.format(remote_address))
+        self.protocols[remote_address] = protocol
+        protocol.connection_made(SymNetSharedTransport(self, remote_address))
+
+
+class SymNetDeviceManager:
+    """
+    Manages several SymNet devices, all devices with the same local address share one UDP socket.
+
+    Remote addresses are resolved once, the devices have to answer from the resolved address.
+    """
+
+    def __init__(self):
+        self._endpoints = {}  # type: typing.Dict[typing.Tuple[str, int], SymNetSharedEndpoint]
+        self.devices = []  # type: typing.List[SymNetDevice]
+        base.cleanup_tasks.append(base.loop.create_task(self._cleanup()))
+
+    async def _endpoint(self, local_address: typing.Tuple[str, int]) -> SymNetSharedEndpoint:
+        endpoint = self._endpoints.get(local_address)
+        if endpoint is None:
+            logger.debug('open shared endpoint on %s', local_address)
+            _, endpoint = await base.loop.create_datagram_endpoint(SymNetSharedEndpoint, local_addr=local_address)
+            self._endpoints[local_address] = endpoint
+        return endpoint
+
+    async def add_device(self, local_address: typing.Tuple[str, int], remote_address: typing.Tuple[str, int]) -> SymNetDevice:
+        endpoint = await self._endpoint(local_address)
+        address_info = await base.loop.getaddrinfo(remote_address[0], remote_address[1],
+                                                   family=endpoint.transport.get_extra_info('socket').family,
+                                                   type=socket.SOCK_DGRAM)
+        resolved_address = address_info[0][4][:2]
+
+        device = SymNetDevice.__new__(SymNetDevice)
+        device._prepare()
+        device.protocol = SymNetRawProtocol(push_callback=device._apply_push_updates)
+        endpoint.attach(resolved_address, device.protocol)
+        self.devices.append(device)
+
+        return device
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        for endpoint in self._endpoints.values():
+            endpoint.transport.close()
+        self.devices.clear()
+        self._endpoints.clear()
+
+    async def _cleanup(self):
+        logger.debug('SymNetDeviceManager awaiting cleanup')
+        await base.cleanup_event.wait()
+        self.close()
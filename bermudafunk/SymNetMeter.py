@@ -0,0 +1,197 @@
+"""
+Level meters of a SymNet device.
+
+Meters are read-only controllers changing at a high rate. A SymNetMeterBank reads a set of them with one batched
+request cycle per period (or takes their pushed values), stores the samples in fixed-size ring buffers and hands
+peak / RMS windows to its subscribers. The device load only depends on the number of meters and the rate, never
+on the number of subscribers.
+
+NumPy is used for the buffers and window calculations if it is installed.
+"""
+import array
+import asyncio
+import logging
+import math
+import typing
+
+from bermudafunk import base
+from bermudafunk.SymNet import SymNetDevice, SymNetPriority, SymNetRawProtocolCallback
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+logger = logging.getLogger(__name__)
+
+SymNetMeterWindow = typing.NamedTuple('SymNetMeterWindow', [('peak', float),
+                                                            ('rms', float)])
+
+
+def _window(samples) -> SymNetMeterWindow:
+    if not len(samples):
+        return SymNetMeterWindow(peak=0.0, rms=0.0)
+    if numpy is not None:
+        return SymNetMeterWindow(peak=float(numpy.max(samples)), rms=float(numpy.sqrt(numpy.mean(numpy.square(samples)))))
+    return SymNetMeterWindow(peak=max(samples), rms=math.sqrt(sum(sample * sample for sample in samples) / len(samples)))
+
+
+class SymNetMeterBuffer:
+    """Ring buffer holding the last size samples of a meter"""
+    __slots__ = ('size', 'count', '_values', '_index')
+
+    def __init__(self, size: int):
+        self.size = int(size)
+        # total number of appended samples
+        self.count = 0
+        if numpy is not None:
+            self._values = numpy.zeros(self.size)
+        else:
+            self._values = array.array('d', bytes(8 * self.size))
+        self._index = 0
+
+    def __len__(self) -> int:
+        return min(self.count, self.size)
+
+    def append(self, value: float):
+        self._values[self._index] = value
+        self._index = (self._index + 1) % self.size
+        self.count += 1
+
+    def latest(self, count: int = None):
+        """The last count samples, all buffered samples if None, oldest first"""
+        count = len(self) if count is None else min(int(count), len(self))
+        start = self._index - count
+        if start >= 0:
+            return self._values[start:self._index]
+        if numpy is not None:
+            return numpy.concatenate((self._values[start:], self._values[:self._index]))
+        return self._values[start:] + self._values[:self._index]
+
+
+class SymNetMeter:
+    __slots__ = ('controller_number', 'buffer', 'value_time')
+
+    def __init__(self, controller_number: int, buffer_size: int):
+        self.controller_number = controller_number
+        self.buffer = SymNetMeterBuffer(buffer_size)
+        self.value_time = 0.0
+
+    def add_sample(self, value: float):
+        self.buffer.append(value)
+        self.value_time = base.loop.time()
+
+    def window(self, sample_count: int = None) -> SymNetMeterWindow:
+        """Peak and RMS of the last sample_count samples"""
+        return _window(self.buffer.latest(sample_count))
+
+    def downsample(self, bucket_count: int, sample_count: int = None) -> typing.List[SymNetMeterWindow]:
+        """Split the last sample_count samples into bucket_count windows, oldest first"""
+        samples = self.buffer.latest(sample_count)
+        bucket_count = max(1, min(int(bucket_count), len(samples)))
+        if numpy is not None:
+            return [_window(bucket) for bucket in numpy.array_split(samples, bucket_count)]
+        return [_window(samples[len(samples) * i // bucket_count:len(samples) * (i + 1) // bucket_count])
+                for i in range(bucket_count)]
+
+
+class SymNetMeterBank:
+    """
+    Reads the meters controller_numbers of a device rate times per second.
+
+    With poll all meters are requested by pipelined GS2 requests once per period. Without poll the bank relies on
+    the device pushing the meter values, see SymNetDevice.subscribe. Each meter keeps history seconds of samples.
+    Subscribers are called once per period with the windows of the last window seconds, calculated once for all.
+    """
+
+    def __init__(self, device: SymNetDevice, controller_numbers: typing.Iterable[int], rate: float = 10.0,
+                 history: float = 60.0, window: float = 0.3, poll: bool = True,
+                 priority: SymNetPriority = SymNetPriority.BACKGROUND):
+        self.device = device
+        self.rate = float(rate)
+        self.poll = poll
+        self.priority = priority
+        self.window_samples = max(1, int(round(window * self.rate)))
+        buffer_size = max(1, int(history * self.rate))
+        self.meters = {int(controller_number): SymNetMeter(int(controller_number), buffer_size)
+                       for controller_number in controller_numbers}  # type: typing.Dict[int, SymNetMeter]
+        self.windows = {}  # type: typing.Dict[int, SymNetMeterWindow]
+        self._subscribers = []  # type: typing.List[typing.Callable[[typing.Dict[int, SymNetMeterWindow]], typing.Any]]
+        self._task = None  # type: typing.Optional[asyncio.Task]
+
+        self.poll_cycles = 0
+        self.missed_samples = 0
+        self.overruns = 0
+
+    def start(self):
+        if self._task is None:
+            self.device.push_listeners.append(self._push_received)
+            self._task = base.loop.create_task(self._poll_loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+            self.device.push_listeners.remove(self._push_received)
+
+    def subscribe(self, callback: typing.Callable[[typing.Dict[int, SymNetMeterWindow]], typing.Any]):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: typing.Callable[[typing.Dict[int, SymNetMeterWindow]], typing.Any]):
+        self._subscribers.remove(callback)
+
+    def _push_received(self, updates: typing.Dict[int, int]):
+        if len(updates) < len(self.meters):
+            for controller_number, controller_value in updates.items():
+                meter = self.meters.get(controller_number)
+                if meter is not None:
+                    meter.add_sample(controller_value)
+        else:
+            for controller_number, meter in self.meters.items():
+                controller_value = updates.get(controller_number)
+                if controller_value is not None:
+                    meter.add_sample(controller_value)
+
+    def _sample_callback(self, meter: SymNetMeter) -> SymNetRawProtocolCallback:
+        def callback(controller_value: typing.Optional[int]):
+            if controller_value is None:
+                self.missed_samples += 1
+            else:
+                meter.add_sample(controller_value)
+
+        return SymNetRawProtocolCallback(callback=callback)
+
+    async def _poll_loop(self):
+        period = 1 / self.rate
+        next_cycle = base.loop.time()
+        while True:
+            if self.poll and self.device.protocol is not None:
+                callback_objs = self.device.protocol.write_value_requests(
+                    ((meter.controller_number, self._sample_callback(meter)) for meter in self.meters.values()),
+                    self.priority
+                )
+                results = await asyncio.gather(*[callback_obj.future for callback_obj in callback_objs],
+                                               loop=base.loop, return_exceptions=True)
+                self.missed_samples += sum(1 for result in results if isinstance(result, Exception))
+            self.poll_cycles += 1
+            self._publish()
+
+            next_cycle += period
+            delay = next_cycle - base.loop.time()
+            if delay < 0:
+                # the device can't keep up with the rate, skip the missed cycles instead of bursting
+                self.overruns += 1
+                next_cycle = base.loop.time()
+                delay = 0
+            await asyncio.sleep(delay, loop=base.loop)
+
+    def _publish(self):
+        if not self._subscribers:
+            return
+        self.windows = {controller_number: meter.window(self.window_samples)
+                        for controller_number, meter in self.meters.items()}
+        for subscriber in self._subscribers:
+            try:
+                subscriber(self.windows)
+            except Exception:
+                logger.exception('meter subscriber failed')
@@ -0,0 +1,164 @@
+"""
+Smooth ramps of SymNet fader and gain controllers.
+
+A SymNetRampEngine interpolates any number of running ramps on one shared timer. Every frame the new values of
+all ramps are issued as CS commands in the same loop iteration, so the scheduler packs them into few datagrams,
+and a value a slow link couldn't send yet is replaced by the next frame instead of queueing up.
+"""
+import asyncio
+import logging
+import math
+import typing
+
+from bermudafunk import base
+from bermudafunk.SymNet import SymNetControllerBase, SymNetPriority, SymNetRawProtocolCallback
+
+logger = logging.getLogger(__name__)
+
+
+# Curves map the ramp progress [0, 1] to the share [0, 1] of the louder end of the ramp.
+# Falling ramps use the curve mirrored in time, so fading in and out with the same curve is symmetric.
+
+def linear(progress: float) -> float:
+    return progress
+
+
+def ease_in_out(progress: float) -> float:
+    return (1 - math.cos(progress * math.pi)) / 2
+
+
+def equal_power(progress: float) -> float:
+    return math.sin(progress * math.pi / 2)
+
+
+curves = {
+    'linear': linear,
+    'ease_in_out': ease_in_out,
+    'equal_power': equal_power,
+}  # type: typing.Dict[str, typing.Callable[[float], float]]
+
+
+class SymNetRamp:
+    __slots__ = ('controller', 'start_value', 'end_value', 'start_time', 'duration', 'curve', 'future', 'sent_value')
+
+    def __init__(self, controller: SymNetControllerBase, end_value: int, start_time: float, duration: float,
+                 curve: typing.Callable[[float], float]):
+        self.controller = controller
+        self.start_value = controller.raw_value
+        self.end_value = int(end_value)
+        self.start_time = start_time
+        self.duration = duration
+        self.curve = curve
+        self.future = base.loop.create_future()
+        self.sent_value = self.start_value
+
+    def value_at(self, now: float) -> typing.Tuple[int, bool]:
+        """The value at the given time and whether the ramp is finished"""
+        if self.duration <= 0 or now >= self.start_time + self.duration:
+            return self.end_value, True
+        progress = max(0.0, (now - self.start_time) / self.duration)
+        if self.end_value >= self.start_value:
+            value = self.start_value + (self.end_value - self.start_value) * self.curve(progress)
+        else:
+            value = self.end_value + (self.start_value - self.end_value) * self.curve(1 - progress)
+        return int(round(value)), False
+
+
+class SymNetRampEngine:
+    """Runs all ramps with frame_rate frames per second on a single timer"""
+
+    def __init__(self, frame_rate: float = 25.0, priority: SymNetPriority = SymNetPriority.ON_AIR):
+        self.frame_interval = 1 / float(frame_rate)
+        self.priority = priority
+        self._ramps = {}  # type: typing.Dict[SymNetControllerBase, SymNetRamp]
+        self._timer = None  # type: typing.Optional[asyncio.TimerHandle]
+        self._next_frame = 0.0
+
+        self.frames = 0
+        self.late_frames = 0
+        self.sent_values = 0
+        self.failed_values = 0
+
+    def __len__(self) -> int:
+        return len(self._ramps)
+
+    def ramp(self, controller: SymNetControllerBase, end_value: int, duration: float,
+             curve: typing.Callable[[float], float] = linear) -> asyncio.Future:
+        """
+        Ramp the controller from its current value to end_value within duration seconds.
+
+        A running ramp of the controller is replaced, its future resolves to False. The returned future resolves to
+        True once the end value has been issued.
+        """
+        assert 0 <= end_value <= 65535
+        previous = self._ramps.pop(controller, None)
+        if previous is not None and not previous.future.done():
+            previous.future.set_result(False)
+
+        ramp = SymNetRamp(controller, end_value, base.loop.time(), duration, curve)
+        self._ramps[controller] = ramp
+        if self._timer is None:
+            self._next_frame = ramp.start_time
+            self._frame()
+        return ramp.future
+
+    def crossfade(self, fade_out: SymNetControllerBase, fade_in: SymNetControllerBase, duration: float, level: int = 65535,
+                  curve: typing.Callable[[float], float] = equal_power) -> asyncio.Future:
+        """Fade out one controller to 0 while fading in the other one to level"""
+        return asyncio.gather(self.ramp(fade_out, 0, duration, curve), self.ramp(fade_in, level, duration, curve),
+                              loop=base.loop)
+
+    def cancel(self, controller: SymNetControllerBase):
+        """Stop the ramp of the controller at its current value"""
+        ramp = self._ramps.pop(controller, None)
+        if ramp is not None and not ramp.future.done():
+            ramp.future.set_result(False)
+
+    def _frame(self):
+        self._timer = None
+        now = base.loop.time()
+        self.frames += 1
+
+        finished = []
+        for controller, ramp in self._ramps.items():
+            value, done = ramp.value_at(now)
+            if value != ramp.sent_value or done:
+                ramp.sent_value = value
+                # noinspection PyProtectedMember
+                controller._set_raw_value(value)
+                self._send(controller)
+            if done:
+                finished.append(controller)
+        for controller in finished:
+            ramp = self._ramps.pop(controller)
+            if not ramp.future.done():
+                ramp.future.set_result(True)
+
+        if not self._ramps:
+            return
+        self._next_frame += self.frame_interval
+        if self._next_frame < now:
+            # the loop was too busy to keep the frame rate, skip the missed frames
+            self.late_frames += 1
+            self._next_frame = now + self.frame_interval
+        self._timer = base.loop.call_at(self._next_frame, self._frame)
+
+    def _send(self, controller: SymNetControllerBase):
+        self.sent_values += 1
+        callback_obj = controller.proto.write_controller_value(
+            controller.controller_number,
+            controller.raw_value,
+            SymNetRawProtocolCallback(callback=self._acknowledge_callback),
+            self.priority
+        )
+        callback_obj.future.add_done_callback(self._sent)
+
+    @staticmethod
+    def _acknowledge_callback(acknowledged: typing.Optional[bool]):
+        return bool(acknowledged)
+
+    def _sent(self, future: asyncio.Future):
+        if future.cancelled():
+            return
+        if future.exception() is not None or not future.result():
+            self.failed_values += 1
@@ -0,0 +1,762 @@
+"""
+Local emulation of a SymNet device for load and latency testing.
+
+The simulator speaks the subset of the SymNet control protocol used by bermudafunk over UDP, TCP or a pty:
+    CS <controller> <value>     set a controller, answered with ACK or NAK
+    GS2 <controller>            get a controller, answered with '<controller> <value>'
+    GSB <controller> <count>    get a block of controllers, answered with one '<value>' line per controller
+    PU <0|1>                    disable / enable pushing of value changes to the sender, answered with ACK
+    LP <preset>                 load a preset stored in SymNetSimulator.presets, answered with ACK or NAK
+    NOP                         answered with ACK
+
+Pushed changes are sent as '#NNNNN=VVVVV' lines. Latency, jitter, packet loss and reordering of the
+simulated link can be configured.
+
+Run a simulator:
+    python -m bermudafunk.SymNetSimulator serve --port 48630 --latency 0.005 --loss 0.01
+
+Run the benchmark driver against an in-process simulator:
+    python -m bermudafunk.SymNetSimulator benchmark --controllers 5000 --requests 20000
+
+Compare the reply correlation with the regex scan it replaced, at 1, 100 and 1000 outstanding requests:
+    python -m bermudafunk.SymNetSimulator correlation --replies 10000
+
+Check the push parser against the regex parser it replaced on fuzzed datagrams and compare their speed:
+    python -m bermudafunk.SymNetSimulator parser --datagrams 100000
+
+Compare the memory taken by 10k controllers as plain objects and in the compact registry:
+    python -m bermudafunk.SymNetSimulator memory --controllers 10000
+
+Check the TCP and the RS-232 transports against a simulator on a loopback TCP server or a pty pair,
+connect_serial requires pyserial-asyncio:
+    python -m bermudafunk.SymNetSimulator tcp --requests 2000
+    python -m bermudafunk.SymNetSimulator pty --requests 2000
+
+Serve them instead:
+    python -m bermudafunk.SymNetSimulator serve --transport tcp --port 48631
+    python -m bermudafunk.SymNetSimulator serve --transport pty
+
+Check that no lost command is acknowledged by the ACK of another one, over a lossy link:
+    python -m bermudafunk.SymNetSimulator loss --requests 2000 --loss 0.1
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+import tracemalloc
+import tty
+import typing
+
+from bermudafunk import base
+from bermudafunk.SymNet import SymNetButtonController, SymNetCommandScheduler, SymNetController, \
+    SymNetControllerRegistry, SymNetControllerView, SymNetCorrelation, SymNetDevice, SymNetRawControllerState, \
+    SymNetPriority, SymNetRawProtocol, SymNetRawProtocolCallback, SymNetRequest, SymNetTimeoutError, \
+    parse_push_line, parse_push_lines
+
+logger = logging.getLogger(__name__)
+
+SymNetLinkConditions = typing.NamedTuple('SymNetLinkConditions', [('latency', float),
+                                                                  ('jitter', float),
+                                                                  ('loss', float),
+                                                                  ('reorder', float)])
+
+BenchmarkResult = typing.NamedTuple('BenchmarkResult', [('requests', int),
+                                                        ('failed', int),
+                                                        ('duration', float),
+                                                        ('requests_per_second', float),
+                                                        ('p50', float),
+                                                        ('p99', float)])
+
+CorrelationBenchmarkResult = typing.NamedTuple('CorrelationBenchmarkResult', [('outstanding', int),
+                                                                              ('indexed', float),
+                                                                              ('regex_scan', float)])
+
+ParserBenchmarkResult = typing.NamedTuple('ParserBenchmarkResult', [('lines', int),
+                                                                    ('parser', float),
+                                                                    ('regex', float),
+                                                                    ('push_path', float),
+                                                                    ('former_push_path', float)])
+
+MemoryBenchmarkResult = typing.NamedTuple('MemoryBenchmarkResult', [('controllers', int),
+                                                                    ('plain', int),
+                                                                    ('registry', int)])
+
+
+class SymNetSimulator(asyncio.DatagramProtocol):
+    """Answers SymNet commands like a device with controller_count controllers, numbered from 1"""
+
+    def __init__(self, controller_count: int = 10000, conditions: SymNetLinkConditions = None):
+        self.controller_count = int(controller_count)
+        self.conditions = conditions if conditions else SymNetLinkConditions(latency=0, jitter=0, loss=0, reorder=0)
+        self.values = [0] * (self.controller_count + 1)
+        self.push_subscribers = set()  # type: typing.Set[typing.Tuple[str, int]]
+        self.presets = {}  # type: typing.Dict[int, typing.Dict[int, int]]
+        self.transport = None  # type: typing.Optional[asyncio.DatagramTransport]
+        # received datagrams it returns True for are dropped, to inject a specific loss
+        self.drop = None  # type: typing.Optional[typing.Callable[[bytes], bool]]
+
+        self.received_datagrams = 0
+        self.sent_datagrams = 0
+        self.dropped_datagrams = 0
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, address):
+        self.received_datagrams += 1
+        if self.drop is not None and self.drop(data):
+            self.dropped_datagrams += 1
+            return
+        if self._lost():
+            return
+
+        reply = []
+        for line in data.split(b'\r'):
+            if line:
+                reply.extend(self._execute(line.decode(errors='replace').split(), address))
+        if reply:
+            self._send(''.join(reply).encode(), address)
+
+    def _valid_controller(self, controller_number: int) -> bool:
+        return 1 <= controller_number <= self.controller_count
+
+    def _execute(self, arguments: typing.List[str], address) -> typing.List[str]:
+        command = arguments[0].upper()
+        try:
+            if command == 'CS' and len(arguments) == 3:
+                controller_number, controller_value = int(arguments[1]), int(arguments[2])
+                if not self._valid_controller(controller_number) or not 0 <= controller_value <= 65535:
+                    return ['NAK\r']
+                self.set_value(controller_number, controller_value, origin=address)
+                return ['ACK\r']
+            if command == 'GS2' and len(arguments) == 2:
+                controller_number = int(arguments[1])
+                if not self._valid_controller(controller_number):
+                    return ['NAK\r']
+                return ['{:d} {:d}\r'.format(controller_number, self.values[controller_number])]
+            if command == 'GSB' and len(arguments) == 3:
+                controller_number, count = int(arguments[1]), int(arguments[2])
+                if count < 1 or not self._valid_controller(controller_number) or not self._valid_controller(controller_number + count - 1):
+                    return ['NAK\r']
+                return ['{:d}\r'.format(value) for value in self.values[controller_number:controller_number + count]]
+            if command == 'PU' and len(arguments) == 2:
+                if int(arguments[1]):
+                    self.push_subscribers.add(address)
+                else:
+                    self.push_subscribers.discard(address)
+                return ['ACK\r']
+            if command == 'LP' and len(arguments) == 2:
+                preset = self.presets.get(int(arguments[1]))
+                if preset is None:
+                    return ['NAK\r']
+                for controller_number, controller_value in preset.items():
+                    self.set_value(controller_number, controller_value)
+                return ['ACK\r']
+            if command == 'NOP' and len(arguments) == 1:
+                return ['ACK\r']
+        except ValueError:
+            pass
+        return ['NAK\r']
+
+    def set_value(self, controller_number: int, controller_value: int, origin=None):
+        """Change a controller like a desk operator would, pushing the change to all subscribers except its origin"""
+        if self.values[controller_number] == controller_value:
+            return
+        self.values[controller_number] = controller_value
+        line = '#{:05d}={:05d}\r'.format(controller_number, controller_value).encode()
+        for subscriber in self.push_subscribers:
+            if subscriber != origin:
+                self._send(line, subscriber)
+
+    def _lost(self) -> bool:
+        if self.conditions.loss > 0 and random.random() < self.conditions.loss:
+            self.dropped_datagrams += 1
+            return True
+        return False
+
+    def _send(self, data: bytes, address):
+        if self._lost():
+            return
+        delay = max(0.0, self.conditions.latency + random.uniform(-self.conditions.jitter, self.conditions.jitter))
+        if self.conditions.reorder > 0 and random.random() < self.conditions.reorder:
+            # hold the datagram back long enough to let the following ones overtake it
+            delay += self.conditions.latency + self.conditions.jitter + 0.001
+        if delay > 0:
+            base.loop.call_later(delay, self._sendto, data, address)
+        else:
+            self._sendto(data, address)
+
+    def _sendto(self, data: bytes, address):
+        self.sent_datagrams += 1
+        self.transport.sendto(data, address)
+
+
+class SymNetStreamSimulator(SymNetSimulator, asyncio.Protocol):
+    """
+    Answers SymNet commands over a byte stream, like the TCP port or the RS-232 interface of a device.
+
+    One connection is served at a time, the received data is framed on carriage returns.
+    """
+
+    def __init__(self, controller_count: int = 10000, conditions: SymNetLinkConditions = None):
+        super().__init__(controller_count, conditions)
+        self._buffer = bytearray()
+
+    def connection_made(self, transport: asyncio.BaseTransport):
+        super().connection_made(transport)
+        self._buffer.clear()
+
+    def connection_lost(self, exc):
+        self.transport = None
+        self.push_subscribers.clear()
+
+    def data_received(self, data: bytes):
+        self._buffer += data
+        end = self._buffer.rfind(b'\r')
+        if end < 0:
+            return
+        lines = bytes(self._buffer[:end + 1])
+        del self._buffer[:end + 1]
+        # the connection is the address pushed changes are sent to
+        self.datagram_received(lines, 'stream')
+
+    def _sendto(self, data: bytes, address):
+        if self.transport is None:
+            return
+        self.sent_datagrams += 1
+        self.transport.write(data)
+
+
+class SymNetPtyEndpoint:
+    """
+    A SymNetStreamSimulator on the master side of a new pty pair, to be opened by pyserial at slave_path.
+
+    The slave side is kept open until close, so the master doesn't see a hang up between two connections.
+    """
+
+    def __init__(self, simulator: SymNetStreamSimulator):
+        self.simulator = simulator
+        self.slave_path = None  # type: typing.Optional[str]
+        self._slave = None  # type: typing.Optional[int]
+        self._transports = []  # type: typing.List[asyncio.BaseTransport]
+
+    async def open(self):
+        master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.slave_path = os.ttyname(self._slave)
+        reader, _ = await base.loop.connect_read_pipe(lambda: self.simulator, os.fdopen(master, 'rb', buffering=0))
+        writer, _ = await base.loop.connect_write_pipe(asyncio.Protocol, os.fdopen(os.dup(master), 'wb', buffering=0))
+        self._transports = [reader, writer]
+        self.simulator.transport = writer
+
+    def close(self):
+        for transport in self._transports:
+            transport.close()
+        if self._slave is not None:
+            os.close(self._slave)
+            self._slave = None
+
+
+async def serve(local_address: typing.Tuple[str, int], controller_count: int = 10000,
+                conditions: SymNetLinkConditions = None) -> typing.Tuple[asyncio.DatagramTransport, SymNetSimulator]:
+    """Start a simulator listening on the local address"""
+    return await base.loop.create_datagram_endpoint(
+        lambda: SymNetSimulator(controller_count=controller_count, conditions=conditions),
+        local_addr=local_address
+    )
+
+
+async def serve_tcp(local_address: typing.Tuple[str, int], controller_count: int = 10000,
+                    conditions: SymNetLinkConditions = None) -> typing.Tuple[asyncio.AbstractServer, SymNetStreamSimulator]:
+    """Start a simulator accepting TCP connections on the local address"""
+    simulator = SymNetStreamSimulator(controller_count=controller_count, conditions=conditions)
+    server = await base.loop.create_server(lambda: simulator, *local_address)
+    return server, simulator
+
+
+async def serve_pty(controller_count: int = 10000, conditions: SymNetLinkConditions = None) -> SymNetPtyEndpoint:
+    """Start a simulator on a new pty pair, see SymNetPtyEndpoint"""
+    endpoint = SymNetPtyEndpoint(SymNetStreamSimulator(controller_count=controller_count, conditions=conditions))
+    await endpoint.open()
+    return endpoint
+
+
+def _percentile(sorted_values: typing.List[float], percentile: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+async def benchmark(device: SymNetDevice, controller_count: int, request_count: int, concurrency: int) -> BenchmarkResult:
+    """
+    Define controller_count buttons on the device and issue request_count requests with the given concurrency.
+
+    Half of the requests are CS commands, the other half GS2 requests, on randomly chosen controllers.
+    """
+    controllers = list((await device.define_bulk(buttons=range(1, controller_count + 1))).values())
+    latencies = []  # type: typing.List[float]
+    failed = 0
+    remaining = iter(range(request_count))
+
+    async def request(controller: SymNetButtonController, set_value: bool):
+        if set_value:
+            await controller.set(random.random() < 0.5)
+        else:
+            # noinspection PyProtectedMember
+            await controller._retrieve_current_state().future
+
+    async def worker():
+        nonlocal failed
+        for _ in remaining:
+            start = base.loop.time()
+            try:
+                await request(random.choice(controllers), random.random() < 0.5)
+            except SymNetTimeoutError:
+                failed += 1
+                continue
+            latencies.append(base.loop.time() - start)
+
+    start_time = base.loop.time()
+    await asyncio.gather(*[worker() for _ in range(concurrency)], loop=base.loop)
+    duration = base.loop.time() - start_time
+
+    latencies.sort()
+    return BenchmarkResult(
+        requests=request_count,
+        failed=failed,
+        duration=duration,
+        requests_per_second=request_count / duration if duration > 0 else 0.0,
+        p50=_percentile(latencies, 50),
+        p99=_percentile(latencies, 99),
+    )
+
+
+async def check_lost_acknowledge(device: SymNetDevice, simulator: SymNetSimulator, command_count: int = 2000,
+                                 loss: float = 0.1, seed: int = 1) -> int:
+    """
+    Assert that a lost command is never acknowledged by the ACK of another one.
+
+    First the datagram with 'CS 1 111' is dropped and 'CS 2 222' sent before it's retransmitted, both have to reach
+    the device. The same for a BACKGROUND 'CS 3 333', the ON_AIR 'CS 4 444' has to join its retransmission. Then
+    command_count CS commands of 20 workers, each on its own controller and every fourth ON_AIR, run over a link
+    losing loss of the datagrams in both directions. Every acknowledged command has to be executed by the simulator.
+    Returns the number of acknowledged commands.
+    """
+    rng = random.Random(seed)
+    executed = set()  # type: typing.Set[bytes]
+    dropped = []  # type: typing.List[bytes]
+
+    def write(controller_number: int, controller_value: int, priority: SymNetPriority = SymNetPriority.BACKGROUND) -> asyncio.Future:
+        return device.protocol.write_controller_value(
+            controller_number, controller_value, SymNetRawProtocolCallback(callback=lambda acknowledged: acknowledged), priority
+        ).future
+
+    def drop_first(data: bytes) -> bool:
+        if (b'CS 1 111\r' in data or b'CS 3 333\r' in data) and len(dropped) < 2 and data not in dropped:
+            dropped.append(data)
+            return True
+        return False
+
+    simulator.drop = drop_first
+    retransmitted_commands = device.protocol.scheduler.retransmitted_commands
+    first = write(1, 111)
+    await asyncio.sleep(0.001, loop=base.loop)
+    second = write(2, 222)
+    assert await second is True and await first is True
+    assert dropped and simulator.values[1] == 111 and simulator.values[2] == 222, 'CS 1 took the ACK of CS 2'
+    assert device.protocol.scheduler.retransmitted_commands == retransmitted_commands + 1
+
+    received = []  # type: typing.List[bytes]
+    simulator.drop = lambda data: received.append(data) or drop_first(data)
+    first = write(3, 333)
+    await asyncio.sleep(0.001, loop=base.loop)
+    second = write(4, 444, SymNetPriority.ON_AIR)
+    assert await second is True and await first is True
+    assert simulator.values[3] == 333 and simulator.values[4] == 444, 'CS 3 took the ACK of CS 4'
+    assert b'CS 3 333\rCS 4 444\r' in received, 'CS 4 did not join the retransmission of CS 3'
+
+    def drop_random(data: bytes) -> bool:
+        if rng.random() < loss:
+            return True
+        executed.update(line for line in data.split(b'\r') if line.startswith(b'CS '))
+        return False
+
+    simulator.drop = drop_random
+    conditions = simulator.conditions
+    simulator.conditions = conditions._replace(loss=loss)
+    values = iter(rng.sample(range(1, 65536), command_count))
+    acknowledged = 0
+
+    async def worker(controller_number: int):
+        nonlocal acknowledged
+        for controller_value in values:
+            try:
+                priority = SymNetPriority.ON_AIR if controller_number % 4 == 0 else SymNetPriority.BACKGROUND
+                if not await write(controller_number, controller_value, priority):
+                    continue
+            except SymNetTimeoutError:
+                continue
+            command = 'CS {:d} {:d}'.format(controller_number, controller_value).encode()
+            assert command in executed, '{!r} was acknowledged, but never executed'.format(command)
+            acknowledged += 1
+
+    try:
+        await asyncio.gather(*[worker(controller_number) for controller_number in range(1, 21)], loop=base.loop)
+    finally:
+        simulator.drop = None
+        simulator.conditions = conditions
+    return acknowledged
+
+
+async def check_stream(device: SymNetDevice, simulator: SymNetStreamSimulator, controller_count: int = 100,
+                       request_count: int = 2000, reconnect: bool = False) -> int:
+    """
+    Assert that a device connected over a stream reads, sets and follows the controllers of the simulator.
+
+    The controllers are defined with pipelined GS2 requests, request_count CS commands on them are sent at once and
+    a value changed at the simulator has to be pushed. With reconnect the simulator hangs up and a command issued
+    meanwhile has to reach it after the device reconnected. Returns the number of commands sent.
+    """
+    def write(controller_number: int, controller_value: int) -> asyncio.Future:
+        return device.protocol.write_controller_value(
+            controller_number, controller_value, SymNetRawProtocolCallback(callback=lambda acknowledged: acknowledged)
+        ).future
+
+    rng = random.Random(1)
+    for controller_number in range(1, controller_count + 1):
+        simulator.values[controller_number] = rng.randint(0, 65535)
+    controllers = await device.define_bulk(controllers=range(1, controller_count + 1))
+    for controller_number, controller in controllers.items():
+        assert controller.raw_value == simulator.values[controller_number], 'wrong value of {:d}'.format(controller_number)
+
+    expected = {}
+    futures = []
+    for _ in range(request_count):
+        controller_number, controller_value = rng.randint(1, controller_count), rng.randint(0, 65535)
+        expected[controller_number] = controller_value
+        futures.append(write(controller_number, controller_value))
+    assert all(await asyncio.gather(*futures, loop=base.loop)), 'a command was not acknowledged'
+    for controller_number, controller_value in expected.items():
+        assert simulator.values[controller_number] == controller_value, 'wrong value of {:d}'.format(controller_number)
+
+    async def pushed(controller_number: int, controller_value: int):
+        while controllers[controller_number].raw_value != controller_value:
+            await asyncio.sleep(0.001, loop=base.loop)
+
+    await device.protocol.write_command('PU 1\r', SymNetRawProtocolCallback(callback=lambda acknowledged: acknowledged)).future
+    controller_value = (simulator.values[1] + 1) % 65536
+    simulator.set_value(1, controller_value)
+    await asyncio.wait_for(pushed(1, controller_value), 1.0, loop=base.loop)
+
+    if reconnect:
+        simulator.transport.close()
+        controller_value = (controller_value + 1) % 65536
+        assert await write(1, controller_value), 'the command issued while disconnected was not acknowledged'
+        assert simulator.values[1] == controller_value
+        request_count += 1
+    return request_count
+
+
+def benchmark_correlation(outstanding: int, reply_count: int = 10000) -> CorrelationBenchmarkResult:
+    """
+    Time the dispatch of a GS2 reply while outstanding requests are waiting, in seconds per reply.
+
+    Every answered request is replaced by a new one, so the number of outstanding requests stays constant.
+    The regex scan replays the correlation before SymNetCorrelation: the regex of every waiting callback is
+    matched against the reply in the order of the requests and the matching one is removed from the list.
+    """
+    rng = random.Random(1)
+    replies = [rng.randint(1, outstanding) for _ in range(reply_count)]
+
+    def request(controller_number: int) -> SymNetRequest:
+        return SymNetRequest(('GS2', controller_number), 'GS2 {:d}\r'.format(controller_number), controller_number)
+
+    correlation = SymNetCorrelation()
+    for controller_number in range(1, outstanding + 1):
+        correlation.expect_value(controller_number, request(controller_number))
+    start = time.perf_counter()
+    for controller_number in replies:
+        number, _, value = '{:d} 4711'.format(controller_number).encode().partition(b' ')
+        assert correlation.value(int(number), int(value))
+        correlation.expect_value(controller_number, request(controller_number))
+    indexed = (time.perf_counter() - start) / reply_count
+
+    def regex(controller_number: int) -> str:
+        return '^' + str(controller_number) + ' ([0-9]{1,5})\r$'
+
+    waiting = [regex(controller_number) for controller_number in range(1, outstanding + 1)]
+    start = time.perf_counter()
+    for controller_number in replies:
+        data = '{:d} 4711\r'.format(controller_number)
+        for pattern in waiting:
+            if re.match(pattern, data) is not None:
+                waiting.remove(pattern)
+                break
+        else:
+            raise AssertionError('no request waiting for controller {:d}'.format(controller_number))
+        waiting.append(regex(controller_number))
+    regex_scan = (time.perf_counter() - start) / reply_count
+
+    return CorrelationBenchmarkResult(outstanding=outstanding, indexed=indexed, regex_scan=regex_scan)
+
+
+def _regex_push_states(data: bytes) -> typing.Optional[typing.List[typing.Tuple[int, int]]]:
+    """The pushed states found by the former regex parser, None if it failed to decode the datagram"""
+    try:
+        data_str = data.decode()
+    except UnicodeDecodeError:
+        return None
+    states = []
+    for line in data_str.split('\r'):
+        if len(line) > 0:
+            m = re.match('^#([0-9]{5})=(-?[0-9]{4,5})$', line)
+            if m is not None:
+                states.append((int(m.group(1)), int(m.group(2))))
+    return states
+
+
+def _fuzzed_datagram(rng: random.Random) -> bytes:
+    """Pushed lines, some of them mutated by deleting, inserting or replacing bytes, some cut off"""
+    alphabet = b'#=-+0123456789\r\n a\xff'
+    lines = []
+    for _ in range(rng.randint(1, 4)):
+        number, sign, value, digits = rng.randint(0, 99999), rng.choice(('', '-')), rng.randint(0, 99999), rng.choice((4, 5))
+        line = bytearray('#{:05d}={}{:0{}d}'.format(number, sign, value, digits).encode())
+        for _ in range(rng.choice((0, 0, 1, 2))):
+            position = rng.randrange(len(line))
+            operation = rng.randrange(3)
+            if operation == 0:
+                del line[position]
+            elif operation == 1:
+                line.insert(position, rng.choice(alphabet))
+            else:
+                line[position] = rng.choice(alphabet)
+        lines.append(bytes(line))
+    return b'\r'.join(lines) + rng.choice((b'\r', b''))
+
+
+def check_push_parser(datagram_count: int = 100000, seed: int = 1) -> int:
+    """
+    Compare parse_push_lines and parse_push_line with the former regex parser on fuzzed datagrams, returns the number
+    of datagrams compared.
+
+    Datagrams the regex parser couldn't decode at all are skipped, parse_push_lines keeps their valid lines.
+    An AssertionError names the first datagram both parse differently.
+    """
+    rng = random.Random(seed)
+    compared = 0
+    for _ in range(datagram_count):
+        data = _fuzzed_datagram(rng)
+        expected = _regex_push_states(data)
+        if expected is None:
+            continue
+        states = [(state.controller_number, state.controller_value) for state in parse_push_lines(data)]
+        assert states == expected, 'parsed {!r} to {} instead of {}'.format(data, states, expected)
+        states = [(state.controller_number, state.controller_value)
+                  for state in map(parse_push_line, data.split(b'\r')) if state is not None]
+        assert states == expected, 'parsed the lines of {!r} to {} instead of {}'.format(data, states, expected)
+        compared += 1
+    return compared
+
+
+def benchmark_push_parser(datagram_count: int = 10000, lines_per_datagram: int = 20) -> ParserBenchmarkResult:
+    """
+    Time parse_push_lines and the former regex parser on bursts of pushed lines, in seconds per line.
+
+    The push paths run from the received datagram to the hand over of the parsed values: SymNetRawProtocol passes
+    one dictionary per datagram, the former parser queued one task per line. The loop runs once after every datagram.
+    """
+    rng = random.Random(1)
+    datagrams = [''.join('#{:05d}={:05d}\r'.format(rng.randint(1, 99999), rng.randint(0, 65535))
+                         for _ in range(lines_per_datagram)).encode()
+                 for _ in range(datagram_count)]
+    lines = datagram_count * lines_per_datagram
+
+    start = time.perf_counter()
+    for data in datagrams:
+        for _ in parse_push_lines(data):
+            pass
+    parser = (time.perf_counter() - start) / lines
+
+    start = time.perf_counter()
+    for data in datagrams:
+        _regex_push_states(data)
+    regex = (time.perf_counter() - start) / lines
+
+    state_queue = asyncio.Queue(loop=base.loop)
+
+    protocol = SymNetRawProtocol(state_queue.put_nowait)
+
+    async def push_path():
+        for data in datagrams:
+            protocol.datagram_received(data, None)
+            await asyncio.sleep(0, loop=base.loop)
+
+    async def former_push_path():
+        for data in datagrams:
+            for line in data.decode().split('\r'):
+                if len(line) > 0:
+                    m = re.match('^#([0-9]{5})=(-?[0-9]{4,5})$', line)
+                    if m is not None:
+                        asyncio.ensure_future(state_queue.put(SymNetRawControllerState(
+                            controller_number=int(m.group(1)),
+                            controller_value=int(m.group(2))
+                        )), loop=base.loop)
+            await asyncio.sleep(0, loop=base.loop)
+
+    timings = []
+    for path in (push_path, former_push_path):
+        start = time.perf_counter()
+        base.loop.run_until_complete(path())
+        timings.append((time.perf_counter() - start) / lines)
+
+    return ParserBenchmarkResult(lines=lines, parser=parser, regex=regex, push_path=timings[0],
+                                 former_push_path=timings[1])
+
+
+def benchmark_registry_memory(controller_count: int = 10000) -> MemoryBenchmarkResult:
+    """
+    Trace the memory taken by controller_count defined controllers, as plain objects and as registry views.
+
+    Every tenth controller has an observer, the values are filled by one push batch like after subscribing.
+    """
+    async def observe(controller, old_value, new_value):
+        pass
+
+    def define(use_registry: bool) -> int:
+        protocol = SymNetRawProtocol(lambda updates: None)
+        controller_class = SymNetController
+        if use_registry:
+            protocol.registry = SymNetControllerRegistry()
+            controller_class = SymNetControllerView
+        tracemalloc.start()
+        controllers = {}
+        for controller_number in range(1, controller_count + 1):
+            controller = controllers[controller_number] = controller_class(controller_number, protocol, retrieve_state=False)
+            if controller_number % 10 == 0:
+                controller.add_observer(observe)
+        updates = {controller_number: controller_number % 65536 for controller_number in controllers}
+        if use_registry:
+            protocol.registry.apply(updates, controllers)
+        else:
+            for controller_number, controller_value in updates.items():
+                # noinspection PyProtectedMember
+                controllers[controller_number]._set_raw_value(controller_value)
+        del updates
+        traced, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return traced
+
+    return MemoryBenchmarkResult(controllers=controller_count, plain=define(False), registry=define(True))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=['serve', 'benchmark', 'correlation', 'parser', 'loss', 'memory', 'tcp', 'pty'])
+    parser.add_argument('--transport', choices=['udp', 'tcp', 'pty'], default='udp', help='transport served by the serve mode')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=48630)
+    parser.add_argument('--controllers', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--concurrency', type=int, default=64)
+    parser.add_argument('--latency', type=float, default=0.0, help='one way latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='maximum deviation of the latency in seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability to drop a datagram')
+    parser.add_argument('--reorder', type=float, default=0.0, help='probability to delay a datagram behind its successors')
+    parser.add_argument('--registry', action='store_true', help='keep the controller values in a compact registry')
+    parser.add_argument('--rate-limit', type=float, default=SymNetCommandScheduler.rate_limit,
+                        help='datagrams per second sent by the client, 0 for no limit')
+    parser.add_argument('--replies', type=int, default=10000, help='replies dispatched per correlation benchmark')
+    parser.add_argument('--datagrams', type=int, default=100000, help='fuzzed datagrams checked by the parser mode')
+    args = parser.parse_args()
+
+    if args.mode == 'correlation':
+        for outstanding in (1, 100, 1000):
+            result = benchmark_correlation(outstanding, args.replies)
+            print('{r.outstanding:5d} outstanding: indexed {indexed:8.2f} us, regex scan {regex_scan:8.2f} us per reply, '
+                  'speedup {speedup:.1f}x'.format(r=result, indexed=result.indexed * 1e6, regex_scan=result.regex_scan * 1e6,
+                                                  speedup=result.regex_scan / result.indexed))
+        return
+
+    if args.mode == 'parser':
+        print('{:d} fuzzed datagrams parsed like by the regex parser'.format(check_push_parser(args.datagrams)))
+        result = benchmark_push_parser()
+        print('{r.lines:d} pushed lines: parser {parser:.2f} us, regex {regex:.2f} us per line'.format(
+            r=result, parser=result.parser * 1e6, regex=result.regex * 1e6))
+        print('push path {push_path:.2f} us, former push path {former_push_path:.2f} us per line'.format(
+            push_path=result.push_path * 1e6, former_push_path=result.former_push_path * 1e6))
+        return
+
+    if args.mode == 'memory':
+        result = benchmark_registry_memory(args.controllers)
+        print('{r.controllers:d} controllers: {plain:.2f} MiB plain, {registry:.2f} MiB in the registry, '
+              '{per_plain:.0f} / {per_registry:.0f} bytes per controller'.format(
+                  r=result, plain=result.plain / 2 ** 20, registry=result.registry / 2 ** 20,
+                  per_plain=result.plain / result.controllers, per_registry=result.registry / result.controllers))
+        return
+
+    if args.mode == 'serve' and args.transport != 'udp':
+        conditions = SymNetLinkConditions(latency=args.latency, jitter=args.jitter, loss=0, reorder=0)
+        if args.transport == 'tcp':
+            base.loop.run_until_complete(serve_tcp((args.host, args.port), args.controllers, conditions))
+            logger.warning('SymNet simulator accepting TCP connections on %s:%d', args.host, args.port)
+        else:
+            endpoint = base.loop.run_until_complete(serve_pty(args.controllers, conditions))
+            logger.warning('SymNet simulator serving RS-232 on %s', endpoint.slave_path)
+        base.run_loop()
+        return
+
+    if args.mode == 'tcp':
+        server, simulator = base.loop.run_until_complete(serve_tcp((args.host, 0), args.controllers))
+        device = base.loop.run_until_complete(SymNetDevice.connect_tcp(*server.sockets[0].getsockname()[:2]))
+        # reconnect before the retransmissions of the command issued while disconnected run out
+        device.reconnect_delay = 0.01
+        sent = base.loop.run_until_complete(check_stream(device, simulator, min(args.controllers, 1000), args.requests,
+                                                         reconnect=True))
+        print('TCP: {:d} commands acknowledged and executed, pushed value followed, reconnected'.format(sent))
+        device.close()
+        server.close()
+        return
+
+    if args.mode == 'pty':
+        endpoint = base.loop.run_until_complete(serve_pty(args.controllers))
+        device = base.loop.run_until_complete(SymNetDevice.connect_serial(endpoint.slave_path))
+        sent = base.loop.run_until_complete(check_stream(device, endpoint.simulator, min(args.controllers, 1000), args.requests))
+        print('pty {}: {:d} commands acknowledged and executed, pushed value followed'.format(endpoint.slave_path, sent))
+        device.close()
+        endpoint.close()
+        return
+
+    # the loss mode injects its loss itself
+    loss = 0.0 if args.mode == 'loss' else args.loss
+    conditions = SymNetLinkConditions(latency=args.latency, jitter=args.jitter, loss=loss, reorder=args.reorder)
+    transport, simulator = base.loop.run_until_complete(serve((args.host, args.port), args.controllers, conditions))
+
+    if args.mode == 'serve':
+        logger.warning('SymNet simulator listening on %s:%d', args.host, args.port)
+        base.run_loop()
+        return
+
+    device = base.loop.run_until_complete(SymNetDevice.connect((args.host, 0), (args.host, args.port)))
+    device.protocol.scheduler.rate_limit = args.rate_limit if args.rate_limit > 0 else None
+    if args.registry:
+        device.use_registry()
+    if args.mode == 'loss':
+        acknowledged = base.loop.run_until_complete(check_lost_acknowledge(device, simulator, args.requests, args.loss or 0.1))
+        print('no lost command acknowledged, {:d} of {:d} commands acknowledged at {:.0%} loss, {:d} retransmissions'.format(
+            acknowledged, args.requests, args.loss or 0.1, device.protocol.scheduler.retransmitted_commands))
+        device.transport.close()
+        transport.close()
+        return
+    result = base.loop.run_until_complete(benchmark(device, args.controllers, args.requests, args.concurrency))
+    print('{r.requests:d} requests ({r.failed:d} failed) in {r.duration:.3f} s: {r.requests_per_second:.0f} requests/s, '
+          'p50 {p50:.3f} ms, p99 {p99:.3f} ms'.format(r=result, p50=result.p50 * 1000, p99=result.p99 * 1000))
+    device.transport.close()
+    transport.close()
+
+
+if __name__ == '__main__':
+    main()
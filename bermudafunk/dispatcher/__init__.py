@@ -7,15 +7,20 @@ import time
 import typing
 import weakref
 
-from transitions import EventData, MachineError
-
 import bermudafunk.SymNet
+import bermudafunk.SymNetRamp
 from bermudafunk import base
 from bermudafunk.dispatcher.data_types import Studio, StudioLedStatus, LedStatus, ButtonEvent, Button, DispatcherStudioDefinition
-from bermudafunk.dispatcher.transitions import LedAwareMachine as Machine, LedAwareState, LedStateTarget, States, transitions
+from bermudafunk.dispatcher.journal import TransitionJournal
+from bermudafunk.dispatcher.machine import CompiledMachine as Machine, EventData, MachineError
+from bermudafunk.dispatcher.timers import DriftStatistics, TimerScheduler
+from bermudafunk.dispatcher.transitions import OnAir, States, Timer, transitions
 
 logger = logging.getLogger(__name__)
 
+# the studio slot addressed by a button trigger
+_button_trigger_slots = {button.name + '_' + slot: slot for button in Button for slot in ('X', 'Y')}
+
 audit_logger = logging.Logger(__name__)
 if not audit_logger.hasHandlers():
     import sys
@@ -32,13 +37,25 @@ class Dispatcher:
     If the automat isn't on air, studio X is always the studio which could be currently on air.
     Studio Y is only able to signal takeover requests.
 
-    There are three timers which could be used:
+    There are three timers which could be used, all run by one TimerScheduler on the monotonic loop clock:
     - the hourly timer which sends triggers the 'next_hour' event
     - two timeout timers:
         - the immediate state, triggers 'immediate_state_timeout'
         - the immediate release, triggers 'immediate_release_timeout'
-    They are activated if the name of the timer is contained in the state name.
-    The timers are not reset if the name of the timer is in both src and dest state name.
+    They are activated if the destination state requires them, see States.timers.
+    The timers are not reset if both the source and the destination state require them.
+
+    If a studio on air goes silent, silence_detected switches back to the automat. A pending request of the other
+    studio is kept, it takes over from the automat on the next hour.
+
+    With use_crossfade every source has a fader, the incoming source is faded in instead of a hard cut. Its fader is
+    set to 0 before the selector switches to it and ramped up to the nominal level from there. The selector cuts the
+    outgoing source right away, so there is no fade out, the outgoing fader is left at its level.
+
+    With use_journal every transition is journaled, so load recovers the state after a crash as well.
+
+    The full hours are calculated from wall_clock, the other timers run on the loop clock of base.loop. Both can be
+    replaced by a virtual clock, see bermudafunk.dispatcher.simulation.
     """
     AUTOMAT = 'automat'
 
@@ -50,7 +67,8 @@ class Dispatcher:
                  studios: typing.List[DispatcherStudioDefinition],
                  audit_internal_state=False,
                  immediate_state_time=300,
-                 immediate_release_time=30
+                 immediate_release_time=30,
+                 wall_clock: typing.Callable[[], float] = time.time
                  ):
 
         self.file_path = 'state.json'
@@ -99,10 +117,19 @@ class Dispatcher:
 
         self._symnet_controller = symnet_controller
 
-        # task holders: The contained task should trigger the corresponding timeout action
-        self._next_hour_timer = None  # type: typing.Optional[asyncio.Task]
-        self._immediate_state_timer = None  # type: typing.Optional[asyncio.Task]
-        self._immediate_release_timer = None  # type: typing.Optional[asyncio.Task]
+        # faders of the sources by selector value, crossfaded on handovers if a ramp engine is set
+        self._ramp_engine = None  # type: typing.Optional[bermudafunk.SymNetRamp.SymNetRampEngine]
+        self._faders = {}  # type: typing.Dict[int, bermudafunk.SymNet.SymNetControllerBase]
+        self._crossfade_time = 0.0
+        self._crossfade_curve = bermudafunk.SymNetRamp.equal_power
+        self._crossfade_level = 65535
+
+        # journal of the transitions, the state is only saved on cleanup without it
+        self._journal = None  # type: typing.Optional[TransitionJournal]
+
+        # the deadlines of all timers, keyed by Timer, trigger the corresponding timeout action
+        self._wall_clock = wall_clock
+        self._timers = TimerScheduler(wall_clock=wall_clock)
 
         # collecting button presses
         self._dispatcher_button_event_queue = asyncio.Queue(maxsize=1, loop=base.loop)
@@ -141,44 +168,23 @@ class Dispatcher:
         self.__y = None
         self._y = None  # type: typing.Optional[Studio]
 
-        # Collect state objects from States Enum
-        states = [state.value for _, state in States.__members__.items()]
-
-        States.AUTOMAT_ON_AIR.add_callback('enter', self._change_to_automat)
-        States.STUDIO_X_ON_AIR.add_callback('enter', self._change_to_studio)
-
-        # Initialize the underlying transitions machine
+        # Compile the states and transitions into the lookup table of the machine,
+        # button presses without a transition from the current state are ignored
         self._machine = Machine(
             states=States,
+            transitions=transitions,
             initial=States.AUTOMAT_ON_AIR,
+            actions={'switch_to_y': [self._prepare_switch_to_y], 'to_automat': [self._change_to_automat]},
+            on_enter={
+                States.AUTOMAT_ON_AIR: [self._change_to_automat],
+                States.STUDIO_X_ON_AIR: [self._change_to_studio],
+            },
             ignore_invalid_triggers=True,
-            send_event=True,
             before_state_change=[self._before_state_change],
             after_state_change=[self._after_state_change],
             finalize_event=[self._audit_state, self._assure_led_status, self._notify_machine_observers]
         )
 
-        # Add the transitions between the states to the machine
-        for transition in transitions:
-            if 'switch_to_y' in transition:
-                if transition['switch_to_y']:
-                    if 'before' not in transition:
-                        transition['before'] = []
-                    transition['before'].append(self._prepare_switch_to_y)
-                del transition['switch_to_y']
-
-            for name, value in transition.items():
-                if isinstance(value, States):
-                    transition[name] = value.value
-            self._machine.add_transition(**transition)
-
-        # Assure to ignore button presses which are not in any transition
-        for _, button in Button.__members__.items():
-            for kind in ['X', 'Y']:
-                trigger_name = button.name + '_' + kind
-                if trigger_name not in self._machine.events.keys():
-                    self._machine.add_transition(trigger=trigger_name, source='noop', dest='noop')  # noops to complete all combinations of buttons presses
-
         self._machine_observers = weakref.WeakSet()  # type: typing.Set[typing.Callable[[Dispatcher], typing.Any]]
 
         self._started = False
@@ -209,6 +215,10 @@ class Dispatcher:
             return Dispatcher.AUTOMAT
         return self._selector_value_to_studio[self._on_air_selector_value].name
 
+    @property
+    def on_air_selector_value(self) -> int:
+        return self._on_air_selector_value
+
     @property
     def machine(self) -> Machine:
         return self._machine
@@ -220,16 +230,59 @@ class Dispatcher:
     def _prepare_switch_to_y(self, _: EventData = None):
         self._x, self._y = self._y, None
 
+    def use_crossfade(self, ramp_engine: bermudafunk.SymNetRamp.SymNetRampEngine,
+                      faders: typing.Dict[int, bermudafunk.SymNet.SymNetControllerBase],
+                      duration: float = 3.0,
+                      curve: typing.Callable[[float], float] = bermudafunk.SymNetRamp.equal_power,
+                      level: int = 65535):
+        """Fade in the fader of the incoming source to level within duration seconds, faders keyed by selector value"""
+        sources = {self._automat_selector_value} | set(self._studios_to_selector_value.values())
+        missing = sources - set(faders)
+        if missing:
+            raise ValueError('no fader for the selector values {}'.format(sorted(missing)))
+        self._ramp_engine = ramp_engine
+        self._faders = dict(faders)
+        self._crossfade_time = float(duration)
+        self._crossfade_curve = curve
+        self._crossfade_level = int(level)
+
+    def use_journal(self, journal: TransitionJournal):
+        """Journal every transition, load recovers from the journal then"""
+        self._journal = journal
+
     def _change_to_automat(self, _: EventData = None):
         logger.debug('change to automat')
-        self._on_air_selector_value = self._automat_selector_value
-        base.loop.create_task(self._set_current_state())
+        self._change_on_air_selector_value(self._automat_selector_value)
 
     def _change_to_studio(self, _: EventData = None):
         logger.debug('change to studio %s', self._x)
-        self._on_air_selector_value = self._studios_to_selector_value[self._x]
+        self._change_on_air_selector_value(self._studios_to_selector_value[self._x])
+
+    def _change_on_air_selector_value(self, selector_value: int):
+        previous_selector_value = self._on_air_selector_value
+        self._on_air_selector_value = selector_value
+        if self._ramp_engine is not None and previous_selector_value != selector_value:
+            fade_in = self._faders[selector_value]
+            logger.debug('fade in %s after %s', selector_value, previous_selector_value)
+            # the incoming source is switched in muted, the fader goes to 0 ahead of the selector
+            self._ramp_engine.cancel(fade_in)
+            # noinspection PyProtectedMember
+            fade_in._set_raw_value(0)
+            # noinspection PyProtectedMember
+            fade_in._assure_current_state(bermudafunk.SymNet.SymNetPriority.ON_AIR)
+            self._ramp_engine.ramp(fade_in, self._crossfade_level, self._crossfade_time, curve=self._crossfade_curve)
         base.loop.create_task(self._set_current_state())
 
+    def silence_detected(self, selector_value: int):
+        """Fall back to the automat if the source with the selector value is still on air"""
+        if selector_value != self._on_air_selector_value or selector_value == self._automat_selector_value:
+            return
+        logger.warning('silence detected on %s, switch to automat', self.on_air_studio_name)
+        try:
+            self._machine.trigger('silence_detected')
+        except MachineError as e:
+            logger.critical(e)
+
     def _before_state_change(self, event: EventData):
         if event.transition.dest is None:  # internal transition, don't do anything right now
             return
@@ -237,20 +290,20 @@ class Dispatcher:
         # check if button event
         if 'button_event' in event.kwargs.keys():
             button_event = event.kwargs.get('button_event')  # type: ButtonEvent
-            event_name = event.event.name
+            slot = _button_trigger_slots.get(event.trigger)
             # set the studio accordingly
-            if 'X' in event_name:
+            if slot == 'X':
                 self._x = button_event.studio
-            elif 'Y' in event_name:
+            elif slot == 'Y':
                 self._y = button_event.studio
 
         # stop timers if the destination event doesn't require them
-        destination_state = event.transition.dest
-        if 'next_hour' not in destination_state:
+        timers = event.transition.dest_state.timers
+        if Timer.NEXT_HOUR not in timers:
             self._stop_next_hour_timer()
-        if 'immediate_state' not in destination_state:
+        if Timer.IMMEDIATE_STATE not in timers:
             self._stop_immediate_state_timer()
-        if 'immediate_release' not in destination_state:
+        if Timer.IMMEDIATE_RELEASE not in timers:
             self._stop_immediate_release_timer()
 
     def _after_state_change(self, event: EventData):
@@ -258,26 +311,32 @@ class Dispatcher:
             return
 
         # if the destination state doesn't require a studio, set it to None
-        for tmp in ['X', 'Y']:
-            if event.transition.dest and tmp not in event.transition.dest:
-                setattr(self, '_' + tmp.lower(), None)
+        destination_state = event.transition.dest_state  # type: States
+        if not destination_state.uses_x:
+            self._x = None
+        if not destination_state.uses_y:
+            self._y = None
 
         # start timers as needed
-        destination_state = event.transition.dest
-        if 'next_hour' in destination_state:
+        timers = destination_state.timers
+        if Timer.NEXT_HOUR in timers:
             self._start_next_hour_timer()
-        if 'immediate_state' in destination_state:
+        if Timer.IMMEDIATE_STATE in timers:
             self._start_immediate_state_timer()
-        if 'immediate_release' in destination_state:
+        if Timer.IMMEDIATE_RELEASE in timers:
             self._start_immediate_release_timer()
 
+        if self._journal is not None:
+            self._journal.append(self._machine.state, self._x.name if self._x else None, self._y.name if self._y else None)
+
     async def _cleanup(self):
         await base.cleanup_event.wait()
         logger.debug('cleanup timers')
-        self._stop_next_hour_timer()
-        self._stop_immediate_state_timer()
-        self._stop_immediate_release_timer()
-        self.save()
+        self._timers.close()
+        if self._journal is not None:
+            await self._journal.close()
+        else:
+            self.save()
 
     async def _process_studio_button_events(self):
         while True:
@@ -315,7 +374,7 @@ class Dispatcher:
     def _assure_led_status(self, _: EventData = None):
         """Set the led state in studios"""
         logger.debug('assure led status')
-        new_led_state = self._machine.get_state(self._machine.state).led_state_target  # type: LedStateTarget
+        new_led_state = self._machine.current_state.led_state_target
         for studio in self._studios:
             if studio == self._x:
                 logger.debug(new_led_state.x)
@@ -327,15 +386,15 @@ class Dispatcher:
 
     def _audit_state(self, _: EventData = None):
         """Assure the required studios and only these are set"""
-        state = self._machine.state
-        if 'X' in state:
+        state = self._machine.current_state  # type: States
+        if state.uses_x:
             if self._x is None:
                 logger.critical('X in state and self._X is None')
         else:
             if self._x is not None:
                 logger.critical('X not in state and self._X is not None')
 
-        if 'Y' in state:
+        if state.uses_y:
             if self._y is None:
                 logger.critical('Y in state and self._Y is None')
         else:
@@ -346,106 +405,77 @@ class Dispatcher:
         """In case something is going terrible wrong regarding the communication with the SymNetController, just the value again on a regular time frame"""
         while True:
             logger.debug('Assure that the controller have the desired state!')
-            await self._set_current_state()
+            await self._set_current_state(priority=bermudafunk.SymNet.SymNetPriority.BACKGROUND)
             sleep_time = random.randint(300, 600)
             logger.debug('Sleep for %s seconds', sleep_time)
             await asyncio.sleep(sleep_time)
 
-    async def _set_current_state(self, *_, **__):
+    async def _set_current_state(self, *_, priority: bermudafunk.SymNet.SymNetPriority = bermudafunk.SymNet.SymNetPriority.ON_AIR, **__):
         logger.info('Set the controller state now to %s!', self._on_air_selector_value)
-        await self._symnet_controller.set_position(self._on_air_selector_value)
+        try:
+            await self._symnet_controller.set_position(self._on_air_selector_value, priority)
+        except bermudafunk.SymNet.SymNetTimeoutError as e:
+            logger.error('Could not set the controller state: %s', e)
 
     def _start_next_hour_timer(self, _: EventData = None):
-        """Start the next hour timer if it isn't running already or has already completed"""
-        if self._next_hour_timer and not self._next_hour_timer.done():
+        """Schedule the next hour timer at the next full hour if it isn't scheduled already"""
+        if Timer.NEXT_HOUR in self._timers:
             return
-
-        self._next_hour_timer = base.loop.create_task(self.__hour_timer())
-
-    async def __hour_timer(self):
-        """Try to issue the trigger event as closely as possible to the full hour"""
         logger.debug('start hour timer')
+        self._timers.schedule_wall(Timer.NEXT_HOUR,
+                                   calc_next_hour_timestamp(now=datetime.datetime.fromtimestamp(self._wall_clock())),
+                                   self._next_hour_timeout)
 
+    def _next_hour_timeout(self):
+        logger.info('hourly event %s', time.strftime('%Y-%m-%dT%H:%M:%S%z', time.localtime(self._wall_clock())))
         try:
-            next_hour_timestamp = calc_next_hour_timestamp()
-            duration_to_next_hour = next_hour_timestamp - time.time()
-            while duration_to_next_hour > 0.3:
-                logger.debug('duration to next full hour %s', duration_to_next_hour)
-
-                sleep_time = duration_to_next_hour - 0.3
-                if duration_to_next_hour > 2:
-                    sleep_time = duration_to_next_hour - 2
-                    logger.debug('sleep time %s', sleep_time)
-                    await asyncio.sleep(sleep_time)
-                else:
-                    logger.debug('sleep time %s', sleep_time)
-                    await asyncio.sleep(sleep_time)
-                    break
-                duration_to_next_hour = next_hour_timestamp - time.time()
-
-            logger.info('hourly event %s', time.strftime('%Y-%m-%dT%H:%M:%S%z'))
-            try:
-                self._machine.trigger('next_hour')
-            except MachineError as e:
-                logger.critical(e)
+            self._machine.trigger('next_hour')
+        except MachineError as e:
+            logger.critical(e)
 
-            self._assure_led_status()
-        finally:
-            self._next_hour_timer = None
+        self._assure_led_status()
 
     def _stop_next_hour_timer(self, _: EventData = None):
-        if self._next_hour_timer:
+        if self._timers.cancel(Timer.NEXT_HOUR):
             logger.debug('stop next hour timer')
-            self._next_hour_timer.cancel()
-            self._next_hour_timer = None
 
     def _start_immediate_state_timer(self, _: EventData = None):
-        if self._immediate_state_timer and not self._immediate_state_timer.done():
+        if Timer.IMMEDIATE_STATE in self._timers:
             return
-
-        self._immediate_state_timer = base.loop.create_task(self.__immediate_state_timer())
-
-    async def __immediate_state_timer(self):
         logger.debug('start immediate state timer')
+        self._timers.schedule(Timer.IMMEDIATE_STATE, self.immediate_state_time, self._immediate_state_timeout)
 
+    def _immediate_state_timeout(self):
         try:
-            await asyncio.sleep(self.immediate_state_time)
-            try:
-                self._machine.trigger('immediate_state_timeout')
-            except MachineError as e:
-                logger.critical(e)
-        finally:
-            self._immediate_state_timer = None
+            self._machine.trigger('immediate_state_timeout')
+        except MachineError as e:
+            logger.critical(e)
 
     def _stop_immediate_state_timer(self, _: EventData = None):
-        if self._immediate_state_timer:
+        if self._timers.cancel(Timer.IMMEDIATE_STATE):
             logger.debug('stop immediate state timer')
-            self._immediate_state_timer.cancel()
-            self._immediate_state_timer = None
 
     def _start_immediate_release_timer(self, _: EventData = None):
-        logger.debug('start immediate release timer')
-
-        if self._immediate_release_timer and self._immediate_release_timer.done():
+        if Timer.IMMEDIATE_RELEASE in self._timers:
             return
+        logger.debug('start immediate release timer')
+        self._timers.schedule(Timer.IMMEDIATE_RELEASE, self.immediate_release_time, self._immediate_release_timeout)
 
-        self._immediate_release_timer = base.loop.create_task(self.__immediate_release_timer())
-
-    async def __immediate_release_timer(self):
+    def _immediate_release_timeout(self):
         try:
-            await asyncio.sleep(self.immediate_release_time)
-            try:
-                self._machine.trigger('immediate_release_timeout')
-            except MachineError as e:
-                logger.critical(e)
-        finally:
-            self._immediate_release_timer = None
+            self._machine.trigger('immediate_release_timeout')
+        except MachineError as e:
+            logger.critical(e)
 
     def _stop_immediate_release_timer(self, _: EventData = None):
-        if self._immediate_release_timer:
+        if self._timers.cancel(Timer.IMMEDIATE_RELEASE):
             logger.debug('stop immediate release timer')
-            self._immediate_release_timer.cancel()
-            self._immediate_release_timer = None
+
+    @property
+    def hour_drift(self) -> typing.Dict[str, float]:
+        """How far the hourly switches fired from the full hour in seconds, positive if late"""
+        statistics = self._timers.drift.get(Timer.NEXT_HOUR)
+        return statistics.as_dict() if statistics else DriftStatistics().as_dict()
 
     @property
     def status(self):
@@ -458,10 +488,17 @@ class Dispatcher:
 
     def load(self):
         try:
-            with open(self.file_path, 'r') as fp:
-                state = json.load(fp)
-                state = self._save_state(**state)
-                logger.debug(state)
+            if self._journal is not None:
+                state = self._journal.recover()
+                if state is None:
+                    logger.warning('Could load dispatcher state: nothing journaled yet')
+                    return
+            else:
+                with open(self.file_path, 'r') as fp:
+                    state = json.load(fp)
+                    # the journal adds its own keys to the snapshot
+                    state = self._save_state(**{field: state[field] for field in self._save_state._fields})
+            logger.debug(state)
 
             if state.x:
                 self._x = Studio.names[state.x]
@@ -469,10 +506,11 @@ class Dispatcher:
                     self._y = Studio.names[state.y]
 
             # assure that the correct studio is on air
-            if 'automat_on_air' in state.state:
+            on_air = self._machine.get_state(state.state).on_air
+            if on_air is OnAir.AUTOMAT:
                 logger.debug('switch to automat')
                 self._change_to_automat()
-            elif 'studio_X_on_air' in state.state:
+            elif on_air is OnAir.STUDIO:
                 logger.debug('switch to studio')
                 self._change_to_studio()
 
@@ -484,6 +522,8 @@ class Dispatcher:
                 logger.critical('Could load dispatcher state: %s', e)
         except json.JSONDecodeError as e:
             logger.critical('Could load dispatcher state: %s', e)
+        except KeyError as e:
+            logger.critical('Could load dispatcher state, unknown state or studio: %s', e)
 
     def save(self):
         state = self._save_state(
@@ -502,7 +542,7 @@ class Dispatcher:
 def calc_next_hour_timestamp(minutes=0, seconds=0, now=None):
     if not isinstance(now, datetime.datetime):
         now = datetime.datetime.now()
-    next_datetime = now.replace(minute=minutes, second=seconds) + datetime.timedelta(hours=1)
+    next_datetime = now.replace(minute=minutes, second=seconds, microsecond=0) + datetime.timedelta(hours=1)
     next_timestamp = next_datetime.timestamp()
     if next_timestamp - now.timestamp() > 3600:
         next_timestamp -= 3600
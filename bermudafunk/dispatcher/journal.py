@@ -0,0 +1,313 @@
+"""
+A write-ahead journal of the dispatcher state.
+
+Every transition appends one line [sequence, time, state, x, y] to the journal. Appends only queue the record on
+the loop, a single writer task hands everything appended meanwhile to the executor to be encoded, written and
+fsynced at once, so many transitions share one commit and the loop never waits for the disk. Every compact_every records the latest state is
+written atomically to the snapshot, the state.json of the dispatcher, and the journal is truncated.
+
+Recovery takes the snapshot and the journal records with a higher sequence number, a torn last line is discarded
+and corrupt records before it are skipped.
+
+Measure the added transition latency, the commit latency and the recovery time:
+    python -m bermudafunk.dispatcher.journal --transitions 10000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+import typing
+
+from bermudafunk import base
+
+logger = logging.getLogger(__name__)
+
+JournalRecord = typing.NamedTuple('JournalRecord', [('sequence', int),
+                                                    ('time', typing.Optional[float]),
+                                                    ('state', str),
+                                                    ('x', typing.Optional[str]),
+                                                    ('y', typing.Optional[str])])
+
+BenchmarkResult = typing.NamedTuple('BenchmarkResult', [('transitions', int),
+                                                        ('trigger_time', float),
+                                                        ('journaled_trigger_time', float),
+                                                        ('commit_latency', float),
+                                                        ('records_per_commit', float),
+                                                        ('recovery_records', int),
+                                                        ('recovery_time', float)])
+
+
+def _encode(record: JournalRecord) -> bytes:
+    return (json.dumps(list(record), separators=(',', ':')) + '\n').encode()
+
+
+def _decode(line: bytes) -> JournalRecord:
+    record = JournalRecord(*json.loads(line.decode()))
+    if not isinstance(record.sequence, int) or not isinstance(record.state, str):
+        raise ValueError('invalid journal record {!r}'.format(line))
+    return record
+
+
+class TransitionJournal:
+    """
+    Journal at path with the snapshot at snapshot_path.
+
+    The snapshot has the format of Dispatcher.save, extended by the sequence number and time of the record, so
+    a state.json written without the journal is recovered as well.
+    """
+
+    def __init__(self, path: str, snapshot_path: str, compact_every: int = 1000,
+                 wall_clock: typing.Callable[[], float] = time.time, executor=None):
+        self.path = path
+        self.snapshot_path = snapshot_path
+        self.compact_every = int(compact_every)
+        self._wall_clock = wall_clock
+        self._executor = executor
+
+        self._fd = None  # type: typing.Optional[int]
+        self._sequence = 0
+        self._last = None  # type: typing.Optional[JournalRecord]
+        self._uncompacted = 0  # records in the journal since the last snapshot
+        self._pending = []  # type: typing.List[JournalRecord]
+        self._commit_future = None  # type: typing.Optional[asyncio.Future]
+        self._task = None  # type: typing.Optional[asyncio.Task]
+
+        self.records = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.compactions = 0
+
+    def recover(self) -> typing.Optional[JournalRecord]:
+        """
+        The latest state from the snapshot and the journal, None if nothing was saved yet.
+
+        Blocks on the disk, it's meant to be called once on start up before any append. An unterminated or invalid
+        last line is a torn tail of the journal, it's cut off so following appends start on a new line. Invalid
+        lines before it are logged and skipped, the records after them are still replayed.
+        """
+        latest = None
+        try:
+            with open(self.snapshot_path, 'r') as fp:
+                snapshot = json.load(fp)
+            latest = JournalRecord(sequence=snapshot.get('sequence', 0), time=snapshot.get('time'),
+                                   state=snapshot['state'], x=snapshot.get('x'), y=snapshot.get('y'))
+            if not isinstance(latest.sequence, int) or not isinstance(latest.state, str):
+                raise ValueError('invalid snapshot {!r}'.format(snapshot))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            # the journal may still hold the latest state
+            logger.critical('could not read the snapshot, recover from the journal only: %s', e)
+            latest = None
+
+        replayed = 0
+        try:
+            with open(self.path, 'r+b') as fp:
+                lines = fp.readlines()
+                torn_size = 0
+                for index, line in enumerate(lines):
+                    try:
+                        if not line.endswith(b'\n'):
+                            raise ValueError('unterminated journal record {!r}'.format(line))
+                        record = _decode(line)
+                    except (ValueError, TypeError) as e:
+                        if index == len(lines) - 1:
+                            torn_size = len(line)
+                        else:
+                            logger.error('skip corrupt journal line %d: %s', index + 1, e)
+                        continue
+                    if latest is None or record.sequence > latest.sequence:
+                        latest = record
+                        replayed += 1
+                if torn_size:
+                    logger.warning('cut off %d bytes of a torn journal tail', torn_size)
+                    fp.truncate(fp.tell() - torn_size)
+        except FileNotFoundError:
+            pass
+
+        logger.debug('recovered %s, replayed %d journal records', latest, replayed)
+        self._last = latest
+        self._sequence = latest.sequence if latest else 0
+        self._uncompacted = replayed
+        return latest
+
+    def append(self, state: str, x: typing.Optional[str], y: typing.Optional[str]) -> asyncio.Future:
+        """Journal the state, the returned future resolves to True once the record is on the disk, False on failure"""
+        self._sequence += 1
+        record = JournalRecord(sequence=self._sequence, time=round(self._wall_clock(), 3), state=state, x=x, y=y)
+        self._last = record
+        self._pending.append(record)
+        self.records += 1
+        if self._commit_future is None:
+            self._commit_future = base.loop.create_future()
+        future = self._commit_future
+        if self._task is None:
+            self._task = base.loop.create_task(self._commit())
+        return future
+
+    async def close(self):
+        """Commit the pending records, write a final snapshot and close the journal"""
+        if self._task is not None:
+            await self._task
+        if self._uncompacted and self._last is not None:
+            await self._run_in_executor(self._compact, self._last)
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def _run_in_executor(self, func, *args) -> asyncio.Future:
+        return base.loop.run_in_executor(self._executor, func, *args)
+
+    async def _commit(self):
+        while self._pending:
+            # everything appended while the last commit was running goes into this one
+            records, self._pending = self._pending, []
+            future, self._commit_future = self._commit_future, None
+            try:
+                await self._run_in_executor(self._write, records)
+            except OSError as e:
+                self.failed_commits += 1
+                logger.error('could not commit the dispatcher journal: %s', e)
+                future.set_result(False)
+                continue
+            self.commits += 1
+            self._uncompacted += len(records)
+            future.set_result(True)
+
+            if self._uncompacted >= self.compact_every:
+                try:
+                    await self._run_in_executor(self._compact, records[-1])
+                except OSError as e:
+                    logger.error('could not compact the dispatcher journal: %s', e)
+        self._task = None
+
+    def _write(self, records: typing.List[JournalRecord]):
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, b''.join(_encode(record) for record in records))
+        os.fsync(self._fd)
+
+    def _compact(self, record: JournalRecord):
+        temporary_path = self.snapshot_path + '.tmp'
+        with open(temporary_path, 'w') as fp:
+            json.dump({'x': record.x, 'y': record.y, 'state': record.state,
+                       'sequence': record.sequence, 'time': record.time}, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(temporary_path, self.snapshot_path)
+        # the rename has to be on the disk before the journal is truncated
+        directory_fd = os.open(os.path.dirname(self.snapshot_path) or '.', os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+        # records up to the snapshot are obsolete now, a crash before truncating just replays them in vain
+        if self._fd is not None:
+            os.ftruncate(self._fd, 0)
+            os.fsync(self._fd)
+        self._uncompacted = 0
+        self.compactions += 1
+
+
+def benchmark(transitions: int = 10000, compact_every: int = 1000) -> BenchmarkResult:
+    """
+    Cycle a dispatcher through transitions transitions without and with a journal in a temporary directory.
+
+    The loop yields after every transition, like between two button presses, so the writer task commits while
+    transitions keep coming in. The recovery is timed on a journal of transitions records without snapshot.
+    """
+    from bermudafunk.SymNet import SymNetSelectorControllerDummy
+    from bermudafunk.dispatcher import Button, ButtonEvent, Dispatcher, DispatcherStudioDefinition, Studio
+
+    name = 'journal_benchmark'
+    studio = Studio.names[name] if name in Studio.names else Studio(name)
+    button_event = ButtonEvent(studio=studio, button=Button.takeover)
+    sequence = ['takeover_X', 'next_hour', 'immediate_X', 'immediate_X', 'release_X', 'next_hour']
+
+    with tempfile.TemporaryDirectory() as directory:
+        journal = TransitionJournal(os.path.join(directory, 'state.journal'), os.path.join(directory, 'state.json'),
+                                    compact_every=compact_every)
+        commit_latencies = []
+
+        def committed(append_time: float):
+            def callback(_):
+                commit_latencies.append(time.perf_counter() - append_time)
+
+            return callback
+
+        async def run(dispatcher: Dispatcher) -> float:
+            trigger_time = 0.0
+            for i in range(transitions):
+                start = time.perf_counter()
+                dispatcher.machine.trigger(sequence[i % len(sequence)], button_event=button_event)
+                trigger_time += time.perf_counter() - start
+                await asyncio.sleep(0, loop=base.loop)
+            return trigger_time / transitions
+
+        results = []
+        for use_journal in (False, True):
+            dispatcher = Dispatcher(
+                symnet_controller=SymNetSelectorControllerDummy(1, 2),
+                automat_selector_value=1,
+                studios=[DispatcherStudioDefinition(studio=studio, selector_value=2)]
+            )
+            if use_journal:
+                dispatcher.use_journal(journal)
+                append = journal.append
+
+                def timed_append(*args):
+                    future = append(*args)
+                    if not future.done():
+                        future.add_done_callback(committed(time.perf_counter()))
+                    return future
+
+                journal.append = timed_append
+            results.append(base.loop.run_until_complete(run(dispatcher)))
+            # noinspection PyProtectedMember
+            dispatcher._timers.close()
+        base.loop.run_until_complete(journal.close())
+        commits = journal.commits
+
+        recovery_journal = TransitionJournal(os.path.join(directory, 'recovery.journal'),
+                                             os.path.join(directory, 'recovery.json'))
+        with open(recovery_journal.path, 'wb') as fp:
+            for i in range(transitions):
+                fp.write(_encode(JournalRecord(sequence=i + 1, time=time.time(), state='studio_X_on_air',
+                                               x=name, y=None)))
+        start = time.perf_counter()
+        recovered = recovery_journal.recover()
+        recovery_time = time.perf_counter() - start
+        assert recovered.sequence == transitions
+
+    return BenchmarkResult(
+        transitions=transitions,
+        trigger_time=results[0],
+        journaled_trigger_time=results[1],
+        commit_latency=sum(commit_latencies) / len(commit_latencies) if commit_latencies else 0.0,
+        records_per_commit=transitions / commits if commits else 0.0,
+        recovery_records=transitions,
+        recovery_time=recovery_time,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--transitions', type=int, default=10000)
+    parser.add_argument('--compact-every', type=int, default=1000)
+    args = parser.parse_args()
+
+    result = benchmark(args.transitions, args.compact_every)
+    print('{r.transitions:d} transitions: trigger {plain:.1f} us without, {journaled:.1f} us with journal, '
+          'commit latency {commit:.2f} ms, {r.records_per_commit:.1f} records per fsync'.format(
+              r=result, plain=result.trigger_time * 1e6, journaled=result.journaled_trigger_time * 1e6,
+              commit=result.commit_latency * 1e3))
+    print('recovered {r.recovery_records:d} journal records in {recovery:.2f} ms'.format(
+        r=result, recovery=result.recovery_time * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+"""
+A state machine compiled into a flat lookup table.
+
+Every (source state, trigger) pair maps to one CompiledTransition holding the destination, its state object with
+the precomputed flags and the actions to run before the state change. Triggering is a single dictionary lookup followed
+by the hook calls, without locks or graph bookkeeping. Graphs are drawn from the same table only on demand with
+the transitions library, which is imported lazily as it requires pygraphviz.
+
+All triggers have to be issued from the event loop thread.
+
+Compare trigger latency and import time with the transitions machine:
+    python -m bermudafunk.dispatcher.machine --cycles 10000
+
+Check that the precomputed flags of the dispatcher states follow their names:
+    python -m bermudafunk.dispatcher.machine --check
+"""
+import argparse
+import enum
+import logging
+import os
+import subprocess
+import sys
+import time
+import typing
+
+logger = logging.getLogger(__name__)
+
+Callback = typing.Callable[['EventData'], typing.Any]
+
+
+class MachineError(Exception):
+    pass
+
+
+class CompiledTransition:
+    __slots__ = ('trigger', 'source', 'dest', 'dest_state', 'before')
+
+    def __init__(self, trigger: str, source: str, dest: typing.Optional[str], dest_state, before: typing.Tuple[Callback, ...]):
+        self.trigger = trigger
+        self.source = source
+        self.dest = dest  # None for internal transitions without a state change
+        self.dest_state = dest_state
+        self.before = before
+
+    def __repr__(self):
+        return '<CompiledTransition {} {} -> {}>'.format(self.trigger, self.source, self.dest)
+
+
+class EventData:
+    """Passed to every hook of a triggered transition"""
+    __slots__ = ('machine', 'trigger', 'transition', 'kwargs')
+
+    def __init__(self, machine: 'CompiledMachine', trigger: str, transition: CompiledTransition, kwargs: typing.Dict[str, typing.Any]):
+        self.machine = machine
+        self.trigger = trigger
+        self.transition = transition
+        self.kwargs = kwargs
+
+
+class CompiledMachine:
+    """
+    Compiles states and transition definitions in the format of the transitions library.
+
+    Besides trigger, source and dest a transition definition may carry flags like 'switch_to_y': True, the callbacks
+    registered for a flag in actions run before the state change of the transition. Every state can be reached by
+    the automatic trigger 'to_<state>'.
+
+    Hooks are called with an EventData in the order before_state_change, transition actions, on_enter of the
+    destination, after_state_change and finally, even if a hook failed, finalize_event.
+    """
+
+    def __init__(self,
+                 states: typing.Iterable,
+                 transitions: typing.Iterable[typing.Dict[str, typing.Any]],
+                 initial,
+                 actions: typing.Dict[str, typing.Iterable[Callback]] = None,
+                 on_enter: typing.Dict[typing.Any, typing.Iterable[Callback]] = None,
+                 ignore_invalid_triggers: bool = False,
+                 before_state_change: typing.Iterable[Callback] = (),
+                 after_state_change: typing.Iterable[Callback] = (),
+                 finalize_event: typing.Iterable[Callback] = ()):
+        self._states = {_state_name(state): state for state in states}  # type: typing.Dict[str, typing.Any]
+        self._state = _state_name(initial)
+        self._ignore_invalid_triggers = ignore_invalid_triggers
+        self._before_state_change = tuple(before_state_change)
+        self._after_state_change = tuple(after_state_change)
+        self._finalize_event = tuple(finalize_event)
+        self._on_enter = {_state_name(state): tuple(callbacks) for state, callbacks in (on_enter or {}).items()}
+
+        actions = actions or {}
+        # the explicitly defined transitions, used to draw graphs
+        self._definitions = []  # type: typing.List[CompiledTransition]
+        self._table = {}  # type: typing.Dict[typing.Tuple[str, str], CompiledTransition]
+        for definition in transitions:
+            before = []
+            for flag, value in definition.items():
+                if flag not in ('trigger', 'source', 'dest') and value:
+                    before.extend(actions.get(flag, ()))
+            dest = _state_name(definition['dest']) if definition.get('dest') is not None else None
+            sources = definition['source'] if isinstance(definition['source'], (list, tuple)) else [definition['source']]
+            for source in sources:
+                transition = CompiledTransition(definition['trigger'], _state_name(source), dest,
+                                                self._states[dest] if dest is not None else None, tuple(before))
+                if (transition.source, transition.trigger) in self._table:
+                    raise ValueError('duplicate transition {!r}'.format(transition))
+                self._table[(transition.source, transition.trigger)] = transition
+                self._definitions.append(transition)
+
+        for dest in self._states:
+            trigger = 'to_' + dest
+            for source in self._states:
+                self._table[(source, trigger)] = CompiledTransition(trigger, source, dest, self._states[dest], ())
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    @property
+    def current_state(self):
+        return self._states[self._state]
+
+    @property
+    def states(self) -> typing.Dict[str, typing.Any]:
+        return self._states
+
+    def get_state(self, name: str):
+        return self._states[name]
+
+    def get_transition(self, trigger: str, source: str = None) -> typing.Optional[CompiledTransition]:
+        return self._table.get((self._state if source is None else source, trigger))
+
+    def trigger(self, trigger: str, **kwargs) -> bool:
+        """Run the transition for the trigger from the current state, False if ignored as invalid"""
+        transition = self._table.get((self._state, trigger))
+        if transition is None:
+            if not self._ignore_invalid_triggers:
+                raise MachineError("Can't trigger event {} from state {}!".format(trigger, self._state))
+            logger.debug("Can't trigger event %s from state %s - ignored", trigger, self._state)
+            return False
+
+        event = EventData(self, trigger, transition, kwargs)
+        try:
+            for callback in self._before_state_change:
+                callback(event)
+            for callback in transition.before:
+                callback(event)
+            if transition.dest is not None:
+                self._state = transition.dest
+                for callback in self._on_enter.get(transition.dest, ()):
+                    callback(event)
+            for callback in self._after_state_change:
+                callback(event)
+        finally:
+            for callback in self._finalize_event:
+                callback(event)
+        return True
+
+    def get_graph(self, show_roi: bool = False):
+        """A pygraphviz graph of the machine, only the current state and its neighbours with show_roi"""
+        from bermudafunk.dispatcher.transitions import graph_machine_class
+
+        machine = graph_machine_class()(
+            states=list(self._states.values()),
+            initial=self._state,
+            transitions=[{'trigger': transition.trigger, 'source': transition.source, 'dest': transition.dest}
+                         for transition in self._definitions],
+            auto_transitions=False,
+            ignore_invalid_triggers=True,
+        )
+        return machine.get_graph(show_roi=show_roi)
+
+
+def _state_name(state) -> str:
+    if isinstance(state, str):
+        return state
+    return state.value if isinstance(state, enum.Enum) else state.name
+
+
+def benchmark(cycles: int = 10000) -> typing.Dict[str, float]:
+    """
+    Time a cycle of button presses and hourly handovers on the dispatcher states with both machines.
+
+    The import times of bermudafunk.dispatcher.transitions are measured in fresh interpreters. For the transitions
+    machine the graph machine is built as well, the module did so at import time while the dispatcher used it.
+    """
+    from bermudafunk.dispatcher.transitions import States, transitions
+    from transitions.extensions import LockedGraphMachine
+
+    def noop(*_, **__):
+        pass
+
+    sequence = ['takeover_X', 'next_hour', 'immediate_X', 'immediate_X', 'release_X', 'next_hour']
+    definitions = [{'trigger': definition['trigger'], 'source': definition['source'].value, 'dest': definition['dest'].value}
+                   for definition in transitions]
+
+    compiled = CompiledMachine(states=States, transitions=transitions, initial=States.AUTOMAT_ON_AIR,
+                               ignore_invalid_triggers=True, before_state_change=[noop], after_state_change=[noop],
+                               finalize_event=[noop])
+    library = LockedGraphMachine(states=[state.value for state in States], transitions=definitions,
+                                 initial=States.AUTOMAT_ON_AIR.value, ignore_invalid_triggers=True, send_event=True,
+                                 before_state_change=[noop], after_state_change=[noop], finalize_event=[noop])
+
+    results = {}
+    for name, machine in (('compiled', compiled), ('transitions', library)):
+        start = time.perf_counter()
+        for _ in range(cycles):
+            for trigger in sequence:
+                machine.trigger(trigger)
+        results[name + '_trigger'] = (time.perf_counter() - start) / (cycles * len(sequence))
+        assert machine.state == States.AUTOMAT_ON_AIR.value
+
+    for name, statement in (('compiled', 'import bermudafunk.dispatcher.transitions'),
+                            ('transitions', 'from bermudafunk.dispatcher.transitions import graph_machine_class; '
+                                            'graph_machine_class()')):
+        output = subprocess.check_output([
+            sys.executable, '-c',
+            'import time; start = time.perf_counter(); {}; print(time.perf_counter() - start)'.format(statement)
+        ], env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+        results[name + '_import'] = float(output.splitlines()[-1])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=10000)
+    parser.add_argument('--check', action='store_true', help='only check the flags of the dispatcher states')
+    args = parser.parse_args()
+
+    from bermudafunk.dispatcher.transitions import States, check_state_flags
+    check_state_flags()
+    print('flags of {:d} states follow their names'.format(len(States)))
+    if args.check:
+        return
+
+    results = benchmark(args.cycles)
+    for name in ('compiled', 'transitions'):
+        print('{:12s} trigger {:8.2f} us, import {:8.2f} ms'.format(
+            name, results[name + '_trigger'] * 1e6, results[name + '_import'] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
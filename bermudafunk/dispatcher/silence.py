@@ -0,0 +1,188 @@
+"""
+Silence detection for the sources of the dispatcher selector.
+
+Every source has a rule: if its meter stays at or below the threshold for hold_time seconds while it is on air,
+the dispatcher falls back to the automat. The rules are evaluated incrementally on the samples a
+bermudafunk.SymNetMeter.SymNetMeterBank collected since the last evaluation.
+
+Benchmark the detection with simulated meter feeds:
+    python -m bermudafunk.dispatcher.silence --sources 16 --rate 20 --hold-time 5
+"""
+import argparse
+import logging
+import math
+import random
+import time
+import typing
+
+from bermudafunk.SymNet import SymNetSelectorControllerDummy
+from bermudafunk.SymNetMeter import SymNetMeter, SymNetMeterBank
+from bermudafunk.dispatcher import Button, ButtonEvent, Dispatcher, DispatcherStudioDefinition, Studio
+
+logger = logging.getLogger(__name__)
+
+SilenceRule = typing.NamedTuple('SilenceRule', [('meter', int),
+                                                ('threshold', int),
+                                                ('hold_time', float)])
+
+BenchmarkResult = typing.NamedTuple('BenchmarkResult', [('sources', int),
+                                                        ('samples', int),
+                                                        ('detection_latency', float),
+                                                        ('evaluation_time', float),
+                                                        ('state', str)])
+
+
+class _SilenceState:
+    __slots__ = ('rule', 'meter', 'hold_samples', 'processed', 'silent_samples', 'fired')
+
+    def __init__(self, rule: SilenceRule, meter: SymNetMeter, rate: float):
+        self.rule = rule
+        self.meter = meter
+        self.hold_samples = max(1, int(math.ceil(rule.hold_time * rate)))
+        self.processed = meter.buffer.count
+        self.silent_samples = 0
+        self.fired = False
+
+    def reset(self):
+        self.processed = self.meter.buffer.count
+        self.silent_samples = 0
+        self.fired = False
+
+    def feed(self) -> bool:
+        """Process the new samples of the meter, True if the source just exceeded the hold time"""
+        buffer = self.meter.buffer
+        new_samples = buffer.count - self.processed
+        self.processed = buffer.count
+        threshold = self.rule.threshold
+        for sample in buffer.latest(new_samples):
+            if sample > threshold:
+                self.silent_samples = 0
+                self.fired = False
+            else:
+                self.silent_samples += 1
+        if not self.fired and self.silent_samples >= self.hold_samples:
+            self.fired = True
+            return True
+        return False
+
+
+class SilenceDetector:
+    """
+    Watches the meters of the dispatcher sources, rules are keyed by the selector value of the source.
+
+    Only the source on air is evaluated, silence before a source went on air doesn't count.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, meter_bank: SymNetMeterBank, rules: typing.Dict[int, SilenceRule]):
+        self._dispatcher = dispatcher
+        self._meter_bank = meter_bank
+        self._states = {selector_value: _SilenceState(rule, meter_bank.meters[rule.meter], meter_bank.rate)
+                        for selector_value, rule in rules.items()}  # type: typing.Dict[int, _SilenceState]
+        self._on_air_selector_value = None  # type: typing.Optional[int]
+
+        self.detections = 0
+
+    def start(self):
+        self._meter_bank.subscribe(self._windows_received)
+
+    def stop(self):
+        self._meter_bank.unsubscribe(self._windows_received)
+
+    def _windows_received(self, _):
+        self.evaluate()
+
+    def evaluate(self):
+        on_air_selector_value = self._dispatcher.on_air_selector_value
+        if on_air_selector_value != self._on_air_selector_value:
+            previous = self._states.get(self._on_air_selector_value)
+            if previous is not None:
+                previous.reset()
+            current = self._states.get(on_air_selector_value)
+            if current is not None:
+                current.reset()
+            self._on_air_selector_value = on_air_selector_value
+            return
+
+        state = self._states.get(on_air_selector_value)
+        if state is not None and state.feed():
+            self.detections += 1
+            self._dispatcher.silence_detected(on_air_selector_value)
+
+
+def benchmark(source_count: int = 16, rate: float = 20.0, hold_time: float = 5.0, threshold: int = 1000,
+              silence_after: float = 30.0) -> BenchmarkResult:
+    """
+    Feed simulated meters of source_count studios rate times per second and measure the detection.
+
+    The first studio goes on air and falls silent after silence_after seconds, all other meters stay loud.
+    The detection latency is measured from the first silent sample in simulated time, the evaluation time per
+    meter period in real time.
+    """
+    automat_selector_value = 1
+    definitions = []
+    for i in range(source_count):
+        name = 'silence_benchmark_{:d}'.format(i)
+        studio = Studio.names[name] if name in Studio.names else Studio(name)
+        definitions.append(DispatcherStudioDefinition(studio=studio, selector_value=i + 2))
+    dispatcher = Dispatcher(
+        symnet_controller=SymNetSelectorControllerDummy(1, source_count + 1),
+        automat_selector_value=automat_selector_value,
+        studios=definitions
+    )
+    # the meters are fed directly, the bank doesn't need a device
+    meter_bank = SymNetMeterBank(None, range(1, source_count + 1), rate=rate, history=hold_time * 2)
+    detector = SilenceDetector(dispatcher, meter_bank, {
+        definition.selector_value: SilenceRule(meter=i + 1, threshold=threshold, hold_time=hold_time)
+        for i, definition in enumerate(definitions)
+    })
+
+    on_air = definitions[0].studio
+    for button in (Button.immediate, Button.takeover):
+        dispatcher.machine.trigger(button.name + '_X', button_event=ButtonEvent(studio=on_air, button=button))
+
+    silence_sample = int(silence_after * rate)
+    samples = 0
+    evaluation_time = 0.0
+    detection_latency = float('nan')
+    meters = list(meter_bank.meters.values())
+    while samples < silence_sample + int(hold_time * rate * 2):
+        for meter in meters:
+            if meter is meters[0] and samples >= silence_sample:
+                meter.add_sample(random.randint(0, threshold))
+            else:
+                meter.add_sample(random.randint(threshold + 1, 65535))
+        samples += 1
+
+        start = time.perf_counter()
+        detector.evaluate()
+        evaluation_time += time.perf_counter() - start
+
+        if detector.detections:
+            detection_latency = (samples - silence_sample) / rate
+            break
+
+    return BenchmarkResult(
+        sources=source_count,
+        samples=samples * source_count,
+        detection_latency=detection_latency,
+        evaluation_time=evaluation_time / samples,
+        state=dispatcher.machine.state,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sources', type=int, default=16)
+    parser.add_argument('--rate', type=float, default=20.0, help='meter samples per second')
+    parser.add_argument('--hold-time', type=float, default=5.0, help='seconds of silence before the fallback')
+    parser.add_argument('--threshold', type=int, default=1000)
+    args = parser.parse_args()
+
+    result = benchmark(args.sources, args.rate, args.hold_time, args.threshold)
+    print('{r.sources:d} sources, {r.samples:d} samples: detected after {r.detection_latency:.3f} s '
+          '(hold time {hold_time:.3f} s), {evaluation:.1f} us per evaluation, final state {r.state}'.format(
+              r=result, hold_time=args.hold_time, evaluation=result.evaluation_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
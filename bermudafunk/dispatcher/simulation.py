@@ -0,0 +1,219 @@
+"""
+Run the dispatcher on a virtual clock.
+
+A VirtualClockLoop never sleeps: whenever nothing is ready to run, its clock jumps straight to the next scheduled
+callback. Installed as base.loop it drives the dispatcher, its timers and the SymNetSelectorControllerDummy, so a
+scripted week of button presses and hourly handovers runs in seconds and, for a given seed, always passes the same
+states at the same virtual times.
+
+Simulate a week and report the throughput, the final state and a digest of all transitions:
+    python -m bermudafunk.dispatcher.simulation --days 7 --studios 3 --events-per-hour 6 --seed 1
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import hashlib
+import logging
+import random
+import selectors
+import time
+import typing
+
+from bermudafunk import base
+from bermudafunk.SymNet import SymNetSelectorControllerDummy
+from bermudafunk.dispatcher import Button, ButtonEvent, Dispatcher, DispatcherStudioDefinition, Studio
+from bermudafunk.dispatcher.machine import EventData
+
+logger = logging.getLogger(__name__)
+
+ScriptedEvent = typing.NamedTuple('ScriptedEvent', [('time', float),
+                                                    ('button_event', ButtonEvent)])
+
+SimulationResult = typing.NamedTuple('SimulationResult', [('virtual_time', float),
+                                                          ('real_time', float),
+                                                          ('button_events', int),
+                                                          ('transitions', int),
+                                                          ('next_hours', int),
+                                                          ('state', str),
+                                                          ('on_air_studio', str),
+                                                          ('digest', str)])
+
+
+class VirtualClock:
+    """The virtual loop time in seconds since start and the wall clock time it corresponds to"""
+    __slots__ = ('time', 'epoch')
+
+    def __init__(self, epoch: float):
+        self.time = 0.0
+        self.epoch = epoch
+
+    def advance(self, seconds: float):
+        self.time += seconds
+
+    def wall_clock(self) -> float:
+        return self.epoch + self.time
+
+
+class _VirtualClockSelector(selectors.DefaultSelector):
+    """Polls without blocking and advances the clock by the timeout the loop would have waited instead"""
+
+    def __init__(self, clock: VirtualClock):
+        super().__init__()
+        self._clock = clock
+
+    def select(self, timeout=None):
+        events = super().select(0)
+        if not events and timeout:
+            self._clock.advance(timeout)
+        return events
+
+
+class VirtualClockLoop(asyncio.SelectorEventLoop):
+    """
+    An event loop on a VirtualClock.
+
+    The loop only advances the clock if it would wait otherwise, so a loop without any scheduled callback spins.
+    """
+
+    def __init__(self, clock: VirtualClock):
+        self.clock = clock
+        super().__init__(selector=_VirtualClockSelector(clock))
+
+    def time(self) -> float:
+        return self.clock.time
+
+
+@contextlib.contextmanager
+def installed_loop(loop: asyncio.AbstractEventLoop):
+    """Use loop as base.loop within the context, everything created within stays bound to it"""
+    previous = base.loop
+    base.loop = loop
+    try:
+        yield loop
+    finally:
+        base.loop = previous
+
+
+def week_script(studios: typing.Sequence[Studio], days: float = 7, events_per_hour: float = 6,
+                seed: int = 1) -> typing.List[ScriptedEvent]:
+    """
+    Random button presses of the studios, events_per_hour on average, in seconds since the start.
+
+    Takeover and release are pressed far more often than immediate, like in the real broadcast schedule.
+    """
+    rng = random.Random(seed)
+    buttons = [Button.takeover] * 4 + [Button.release] * 3 + [Button.immediate]
+    script = []
+    now = 0.0
+    duration = days * 24 * 3600
+    while True:
+        now += rng.expovariate(events_per_hour / 3600)
+        if now >= duration:
+            return script
+        script.append(ScriptedEvent(time=now, button_event=ButtonEvent(studio=rng.choice(studios),
+                                                                       button=rng.choice(buttons))))
+
+
+class _TransitionRecorder:
+    """Machine observer counting the transitions and hashing them with their virtual time"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._hash = hashlib.md5()
+        self.transitions = 0
+        self.next_hours = 0
+
+    def __call__(self, dispatcher: Dispatcher, event: EventData):
+        if event.transition.dest is None:
+            return
+        self.transitions += 1
+        if event.trigger == 'next_hour':
+            self.next_hours += 1
+        self._hash.update('{:.3f} {} {} {}\n'.format(self._loop.time(), event.trigger, event.transition.dest,
+                                                     dispatcher.on_air_studio_name).encode())
+
+    @property
+    def digest(self) -> str:
+        return self._hash.hexdigest()
+
+
+def simulate(days: float = 7, studio_count: int = 3, events_per_hour: float = 6, seed: int = 1,
+             start: datetime.datetime = datetime.datetime(2019, 1, 7)) -> SimulationResult:
+    """
+    Press the buttons of studio_count studios for days days from start on, driven by a VirtualClockLoop.
+
+    The button events go through the button event queue of the dispatcher like GPIO presses, the hourly and
+    timeout transitions are fired by its own timers at their virtual time.
+    """
+    clock = VirtualClock(start.timestamp())
+    loop = VirtualClockLoop(clock)
+    try:
+        with installed_loop(loop):
+            studios = []
+            definitions = []
+            for i in range(studio_count):
+                name = 'simulation_{:d}'.format(i)
+                studio = Studio.names[name] if name in Studio.names else Studio(name)
+                studios.append(studio)
+                definitions.append(DispatcherStudioDefinition(studio=studio, selector_value=i + 2))
+            dispatcher = Dispatcher(
+                symnet_controller=SymNetSelectorControllerDummy(1, studio_count + 1),
+                automat_selector_value=1,
+                studios=definitions,
+                wall_clock=clock.wall_clock
+            )
+            recorder = _TransitionRecorder(loop)
+            dispatcher.machine_observers.add(recorder)
+            script = week_script(studios, days, events_per_hour, seed)
+
+            async def run_script():
+                queue = studios[0].dispatcher_button_event_queue
+                for scripted_event in script:
+                    await asyncio.sleep(scripted_event.time - loop.time(), loop=loop)
+                    await queue.put(scripted_event.button_event)
+                await asyncio.sleep(days * 24 * 3600 - loop.time(), loop=loop)
+
+            # noinspection PyProtectedMember
+            processing = loop.create_task(dispatcher._process_studio_button_events())
+            real_start = time.perf_counter()
+            loop.run_until_complete(run_script())
+            real_time = time.perf_counter() - real_start
+
+            processing.cancel()
+            # noinspection PyProtectedMember
+            tasks = [processing, dispatcher._timers.close()]
+            loop.run_until_complete(asyncio.gather(*[task for task in tasks if task is not None],
+                                                   loop=loop, return_exceptions=True))
+    finally:
+        loop.close()
+
+    return SimulationResult(
+        virtual_time=clock.time,
+        real_time=real_time,
+        button_events=len(script),
+        transitions=recorder.transitions,
+        next_hours=recorder.next_hours,
+        state=dispatcher.machine.state,
+        on_air_studio=dispatcher.on_air_studio_name,
+        digest=recorder.digest,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--days', type=float, default=7)
+    parser.add_argument('--studios', type=int, default=3)
+    parser.add_argument('--events-per-hour', type=float, default=6)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    result = simulate(args.days, args.studios, args.events_per_hour, args.seed)
+    print('{r.virtual_time:.0f} s simulated in {r.real_time:.3f} s: {r.button_events:d} button events, '
+          '{r.transitions:d} transitions ({r.next_hours:d} hourly), {rate:.0f} events/s'.format(
+              r=result, rate=(result.button_events + result.transitions) / result.real_time))
+    print('final state {r.state}, on air {r.on_air_studio}, digest {r.digest}'.format(r=result))
+
+
+if __name__ == '__main__':
+    main()
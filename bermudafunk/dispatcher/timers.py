@@ -0,0 +1,158 @@
+"""
+The deadlines of the dispatcher timers, kept in one heap and run by a single task on the monotonic loop clock.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+import typing
+
+from bermudafunk import base
+
+logger = logging.getLogger(__name__)
+
+
+class Deadline:
+    __slots__ = ('key', 'due', 'wall_time', 'callback', 'sequence', 'cancelled')
+
+    def __init__(self, key: typing.Hashable, due: float, wall_time: typing.Optional[float], callback: typing.Callable[[], typing.Any],
+                 sequence: int):
+        self.key = key
+        self.due = due  # in loop time
+        self.wall_time = wall_time  # the wall clock timestamp the deadline is aligned to, if any
+        self.callback = callback
+        self.sequence = sequence
+        self.cancelled = False
+
+    def __lt__(self, other: 'Deadline') -> bool:
+        return (self.due, self.sequence) < (other.due, other.sequence)
+
+
+class DriftStatistics:
+    """How far wall clock aligned deadlines fired from their timestamp, in seconds"""
+    __slots__ = ('count', 'last', 'max', 'total')
+
+    def __init__(self):
+        self.count = 0
+        self.last = 0.0
+        self.max = 0.0
+        self.total = 0.0
+
+    def add(self, drift: float):
+        self.count += 1
+        self.last = drift
+        self.max = max(self.max, abs(drift))
+        self.total += abs(drift)
+
+    def as_dict(self) -> typing.Dict[str, float]:
+        return {'count': self.count, 'last': self.last, 'max': self.max,
+                'mean': self.total / self.count if self.count else 0.0}
+
+
+class TimerScheduler:
+    """
+    Runs at most one deadline per key from a single task.
+
+    Deadlines are kept on the monotonic loop clock. A deadline aligned to a wall clock timestamp is converted once
+    when it's scheduled and only converted again if the wall clock jumped against the loop clock by more than
+    clock_jump_threshold, checked on every wake up and at least every check_interval seconds.
+    """
+    clock_jump_threshold = 0.5  # in seconds
+    check_interval = 60.0  # in seconds
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None, wall_clock: typing.Callable[[], float] = time.time):
+        self._loop = loop if loop is not None else base.loop
+        self._wall_clock = wall_clock
+        self._heap = []  # type: typing.List[Deadline]
+        self._deadlines = {}  # type: typing.Dict[typing.Hashable, Deadline]
+        self._sequence = itertools.count()
+        self._changed = asyncio.Event(loop=self._loop)
+        self._task = None  # type: typing.Optional[asyncio.Task]
+        self._clock_offset = self._current_clock_offset()
+
+        self.drift = {}  # type: typing.Dict[typing.Hashable, DriftStatistics]
+        self.clock_jumps = 0
+
+    def _current_clock_offset(self) -> float:
+        return self._wall_clock() - self._loop.time()
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        return key in self._deadlines
+
+    def schedule(self, key: typing.Hashable, delay: float, callback: typing.Callable[[], typing.Any]):
+        """Call callback after delay seconds, replacing a pending deadline of the key"""
+        self._push(key, self._loop.time() + delay, None, callback)
+
+    def schedule_wall(self, key: typing.Hashable, wall_time: float, callback: typing.Callable[[], typing.Any]):
+        """Call callback at the wall clock timestamp wall_time, replacing a pending deadline of the key"""
+        self._push(key, wall_time - self._clock_offset, wall_time, callback)
+
+    def cancel(self, key: typing.Hashable) -> bool:
+        deadline = self._deadlines.pop(key, None)
+        if deadline is None:
+            return False
+        # removed lazily from the heap
+        deadline.cancelled = True
+        return True
+
+    def close(self) -> typing.Optional[asyncio.Task]:
+        """Cancel all deadlines and the task running them, which is returned to await its end"""
+        for key in list(self._deadlines):
+            self.cancel(key)
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+        return task
+
+    def _push(self, key: typing.Hashable, due: float, wall_time: typing.Optional[float], callback: typing.Callable[[], typing.Any]):
+        self.cancel(key)
+        deadline = Deadline(key, due, wall_time, callback, next(self._sequence))
+        self._deadlines[key] = deadline
+        heapq.heappush(self._heap, deadline)
+        if self._task is None:
+            self._task = self._loop.create_task(self._run())
+        if self._heap[0] is deadline:
+            self._changed.set()
+
+    def _check_clock(self):
+        offset = self._current_clock_offset()
+        if abs(offset - self._clock_offset) <= self.clock_jump_threshold:
+            return
+        logger.warning('wall clock jumped by %.3f seconds, realign deadlines', offset - self._clock_offset)
+        self.clock_jumps += 1
+        self._clock_offset = offset
+        for deadline in self._heap:
+            if deadline.wall_time is not None:
+                deadline.due = deadline.wall_time - offset
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> typing.List[Deadline]:
+        due = []
+        while self._heap and (self._heap[0].cancelled or self._heap[0].due <= now):
+            deadline = heapq.heappop(self._heap)
+            if not deadline.cancelled:
+                del self._deadlines[deadline.key]
+                due.append(deadline)
+        return due
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            self._check_clock()
+            for deadline in self._pop_due(self._loop.time()):
+                if deadline.wall_time is not None:
+                    drift = self._wall_clock() - deadline.wall_time
+                    self.drift.setdefault(deadline.key, DriftStatistics()).add(drift)
+                try:
+                    deadline.callback()
+                except Exception:
+                    logger.exception('timer %s failed', deadline.key)
+
+            timeout = self.check_interval
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0].due - self._loop.time()))
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout, loop=self._loop)
+            except asyncio.TimeoutError:
+                pass
@@ -1,84 +1,134 @@
 import enum
+import functools
 import typing
 
 from transitions import State
-from transitions.extensions import LockedGraphMachine as Machine
-from transitions.extensions.diagrams import GraphMachine
 
 from bermudafunk.dispatcher.data_types import StudioLedStatus, LedStatus, LedState
 
-GraphMachine.style_attributes['node']['default']['shape'] = 'octagon'
-GraphMachine.style_attributes['node']['active']['shape'] = 'doubleoctagon'
-
 LedStateTarget = typing.NamedTuple('LedStateTarget', [('x', StudioLedStatus), ('y', StudioLedStatus), ('other', StudioLedStatus)])
 
 
+@enum.unique
+class Timer(enum.Enum):
+    NEXT_HOUR = 'next_hour'
+    IMMEDIATE_STATE = 'immediate_state'
+    IMMEDIATE_RELEASE = 'immediate_release'
+
+
+@enum.unique
+class OnAir(enum.Enum):
+    AUTOMAT = 'automat_on_air'
+    STUDIO = 'studio_X_on_air'
+
+
+StateFlags = typing.NamedTuple('StateFlags', [('uses_x', bool),
+                                              ('uses_y', bool),
+                                              ('timers', typing.FrozenSet[Timer]),
+                                              ('on_air', typing.Optional[OnAir])])
+
+
 class LedAwareState(State):
-    def __init__(self, name, led_state_target: LedStateTarget, on_enter=None, on_exit=None, ignore_invalid_triggers=False):
+    def __init__(self, name, led_state_target: LedStateTarget, flags: StateFlags, on_enter=None, on_exit=None, ignore_invalid_triggers=False):
         super().__init__(name, on_enter, on_exit, ignore_invalid_triggers)
         self._led_state_target = led_state_target
+        self._flags = flags
 
     @property
     def led_state_target(self) -> LedStateTarget:
         return self._led_state_target
 
+    @property
+    def flags(self) -> StateFlags:
+        return self._flags
+
+    @property
+    def uses_x(self) -> bool:
+        """Studio X is set in this state"""
+        return self._flags.uses_x
+
+    @property
+    def uses_y(self) -> bool:
+        """Studio Y is set in this state"""
+        return self._flags.uses_y
+
+    @property
+    def timers(self) -> typing.FrozenSet[Timer]:
+        """The timers running in this state"""
+        return self._flags.timers
+
+    @property
+    def on_air(self) -> typing.Optional[OnAir]:
+        """Who is on air in this state, None if it isn't a real state"""
+        return self._flags.on_air
+
+
+@functools.lru_cache(maxsize=None)
+def graph_machine_class():
+    """The transitions machine drawing the graphs, imported on demand as it requires pygraphviz"""
+    from transitions.extensions import GraphMachine
+
+    GraphMachine.style_attributes['node']['default']['shape'] = 'octagon'
+    GraphMachine.style_attributes['node']['active']['shape'] = 'doubleoctagon'
+
+    class LedAwareMachine(GraphMachine):
+        state_cls = LedAwareState
+
+        def add_states(self, states, on_enter=None, on_exit=None,
+                       ignore_invalid_triggers=None, **kwargs):
+            """ Add new state(s).
+            Args:
+                states (list, str, dict, Enum or State): a list, a State instance, the
+                    name of a new state, an enumeration (member) or a dict with keywords to pass on to the
+                    State initializer. If a list, each element can be a string, State or enumeration member.
+                on_enter (str or list): callbacks to trigger when the state is
+                    entered. Only valid if first argument is string.
+                on_exit (str or list): callbacks to trigger when the state is
+                    exited. Only valid if first argument is string.
+                ignore_invalid_triggers: when True, any calls to trigger methods
+                    that are not valid for the present state (e.g., calling an
+                    a_to_b() trigger when the current state is c) will be silently
+                    ignored rather than raising an invalid transition exception.
+                    Note that this argument takes precedence over the same
+                    argument defined at the Machine level, and is in turn
+                    overridden by any ignore_invalid_triggers explicitly
+                    passed in an individual state's initialization arguments.
 
-class LedAwareMachine(Machine):
-    state_cls = LedAwareState
-
-    def add_states(self, states, on_enter=None, on_exit=None,
-                   ignore_invalid_triggers=None, **kwargs):
-        """ Add new state(s).
-        Args:
-            states (list, str, dict, Enum or State): a list, a State instance, the
-                name of a new state, an enumeration (member) or a dict with keywords to pass on to the
-                State initializer. If a list, each element can be a string, State or enumeration member.
-            on_enter (str or list): callbacks to trigger when the state is
-                entered. Only valid if first argument is string.
-            on_exit (str or list): callbacks to trigger when the state is
-                exited. Only valid if first argument is string.
-            ignore_invalid_triggers: when True, any calls to trigger methods
-                that are not valid for the present state (e.g., calling an
-                a_to_b() trigger when the current state is c) will be silently
-                ignored rather than raising an invalid transition exception.
-                Note that this argument takes precedence over the same
-                argument defined at the Machine level, and is in turn
-                overridden by any ignore_invalid_triggers explicitly
-                passed in an individual state's initialization arguments.
-
-            **kwargs additional keyword arguments used by state mixins.
-        """
-
-        ignore = ignore_invalid_triggers
-        if ignore is None:
-            ignore = self.ignore_invalid_triggers
-
-        from transitions.core import listify
-        states = listify(states)
-
-        for state in states:
-            from six import string_types
-            from transitions.core import Enum
-            if not isinstance(state, self.state_cls):
-                if isinstance(state, (string_types, Enum)):
-                    state = self._create_state(
-                        state, on_enter=on_enter, on_exit=on_exit,
-                        ignore_invalid_triggers=ignore, **kwargs)
-                elif isinstance(state, dict):
-                    if 'ignore_invalid_triggers' not in state:
-                        state['ignore_invalid_triggers'] = ignore
-                    state = self._create_state(**state)
-            self.states[state.name] = state
-            for model in self.models:
-                self._add_model_to_state(state, model)
-            if self.auto_transitions:
-                for a_state in self.states.keys():
-                    # add all states as sources to auto transitions 'to_<state>' with dest <state>
-                    if a_state == state.name:
-                        self.add_transition('to_%s' % a_state, self.wildcard_all, a_state)
-                    # add auto transition with source <state> to <a_state>
-                    else:
-                        self.add_transition('to_%s' % a_state, state.name, a_state)
+                **kwargs additional keyword arguments used by state mixins.
+            """
+
+            ignore = ignore_invalid_triggers
+            if ignore is None:
+                ignore = self.ignore_invalid_triggers
+
+            from transitions.core import listify
+            states = listify(states)
+
+            for state in states:
+                from six import string_types
+                from transitions.core import Enum
+                if not isinstance(state, self.state_cls):
+                    if isinstance(state, (string_types, Enum)):
+                        state = self._create_state(
+                            state, on_enter=on_enter, on_exit=on_exit,
+                            ignore_invalid_triggers=ignore, **kwargs)
+                    elif isinstance(state, dict):
+                        if 'ignore_invalid_triggers' not in state:
+                            state['ignore_invalid_triggers'] = ignore
+                        state = self._create_state(**state)
+                self.states[state.name] = state
+                for model in self.models:
+                    self._add_model_to_state(state, model)
+                if self.auto_transitions:
+                    for a_state in self.states.keys():
+                        # add all states as sources to auto transitions 'to_<state>' with dest <state>
+                        if a_state == state.name:
+                            self.add_transition('to_%s' % a_state, self.wildcard_all, a_state)
+                        # add auto transition with source <state> to <a_state>
+                        else:
+                            self.add_transition('to_%s' % a_state, state.name, a_state)
+
+    return LedAwareMachine
 
 
 class LedStatuses(enum.Enum):
@@ -106,7 +156,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=False, uses_y=False, timers=frozenset(), on_air=OnAir.AUTOMAT))
     AUTOMAT_ON_AIR_IMMEDIATE_STATE_X = ('automat_on_air_immediate_state_X', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.OFF.value,
@@ -123,7 +173,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset({Timer.IMMEDIATE_STATE}), on_air=OnAir.AUTOMAT))
     FROM_AUTOMAT_ON_AIR_CHANGE_TO_STUDIO_X_ON_NEXT_HOUR = ('from_automat_on_air_change_to_studio_X_on_next_hour', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.BLINK.value,
@@ -140,7 +190,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset({Timer.NEXT_HOUR}), on_air=OnAir.AUTOMAT))
     STUDIO_X_ON_AIR = ('studio_X_on_air', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -157,7 +207,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset(), on_air=OnAir.STUDIO))
     FROM_STUDIO_X_ON_AIR_CHANGE_TO_AUTOMAT_ON_NEXT_HOUR = ('from_studio_X_on_air_change_to_automat_on_next_hour', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -174,7 +224,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset({Timer.NEXT_HOUR}), on_air=OnAir.STUDIO))
     STUDIO_X_ON_AIR_IMMEDIATE_STATE = ('studio_X_on_air_immediate_state', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -191,7 +241,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset({Timer.IMMEDIATE_STATE}), on_air=OnAir.STUDIO))
     STUDIO_X_ON_AIR_IMMEDIATE_RELEASE = ('studio_X_on_air_immediate_release', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -208,7 +258,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.BLINK.value,
             red=LedStatuses.BLINK.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=False, timers=frozenset({Timer.IMMEDIATE_RELEASE}), on_air=OnAir.STUDIO))
     FROM_STUDIO_X_ON_AIR_CHANGE_TO_STUDIO_Y_ON_NEXT_HOUR = ('from_studio_X_on_air_change_to_studio_Y_on_next_hour', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -225,7 +275,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=True, timers=frozenset({Timer.NEXT_HOUR}), on_air=OnAir.STUDIO))
     STUDIO_X_ON_AIR_STUDIO_Y_TAKEOVER_REQUEST = ('studio_X_on_air_studio_Y_takeover_request', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.ON.value,
@@ -242,7 +292,7 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=True, uses_y=True, timers=frozenset(), on_air=OnAir.STUDIO))
     NOOP = ('noop', LedStateTarget(
         x=StudioLedStatus(
             green=LedStatuses.OFF.value,
@@ -259,7 +309,22 @@ class States(LedAwareState, enum.Enum):
             yellow=LedStatuses.OFF.value,
             red=LedStatuses.OFF.value,
         )
-    ))
+    ), StateFlags(uses_x=False, uses_y=False, timers=frozenset(), on_air=None))
+
+
+def check_state_flags():
+    """Raise a ValueError unless the flags of every state follow its name, see bermudafunk.dispatcher.machine"""
+    for state in States:
+        name = state.value
+        on_air = None
+        for kind in OnAir:
+            if kind.value in name:
+                on_air = kind
+                break
+        expected = StateFlags(uses_x='X' in name, uses_y='Y' in name,
+                              timers=frozenset(timer for timer in Timer if timer.value in name), on_air=on_air)
+        if state.flags != expected:
+            raise ValueError('flags {} of state {} do not match its name, expected {}'.format(state.flags, name, expected))
 
 
 transitions = [
@@ -300,4 +365,15 @@ transitions = [
     {'trigger': 'takeover_Y', 'source': States.STUDIO_X_ON_AIR_STUDIO_Y_TAKEOVER_REQUEST, 'dest': States.STUDIO_X_ON_AIR},
     {'trigger': 'release_Y', 'source': States.STUDIO_X_ON_AIR_STUDIO_Y_TAKEOVER_REQUEST, 'dest': States.STUDIO_X_ON_AIR},
     {'trigger': 'release_X', 'source': States.STUDIO_X_ON_AIR_STUDIO_Y_TAKEOVER_REQUEST, 'dest': States.FROM_STUDIO_X_ON_AIR_CHANGE_TO_STUDIO_Y_ON_NEXT_HOUR},
+
+    # a studio on air went silent, see bermudafunk.dispatcher.silence
+    # a pending request of studio Y is kept, it becomes studio X and takes over from the automat on the next hour
+    {'trigger': 'silence_detected', 'source': States.STUDIO_X_ON_AIR, 'dest': States.AUTOMAT_ON_AIR},
+    {'trigger': 'silence_detected', 'source': States.FROM_STUDIO_X_ON_AIR_CHANGE_TO_AUTOMAT_ON_NEXT_HOUR, 'dest': States.AUTOMAT_ON_AIR},
+    {'trigger': 'silence_detected', 'source': States.STUDIO_X_ON_AIR_IMMEDIATE_STATE, 'dest': States.AUTOMAT_ON_AIR},
+    {'trigger': 'silence_detected', 'source': States.STUDIO_X_ON_AIR_IMMEDIATE_RELEASE, 'dest': States.AUTOMAT_ON_AIR},
+    {'trigger': 'silence_detected', 'source': States.FROM_STUDIO_X_ON_AIR_CHANGE_TO_STUDIO_Y_ON_NEXT_HOUR, 'dest': States.FROM_AUTOMAT_ON_AIR_CHANGE_TO_STUDIO_X_ON_NEXT_HOUR,
+     'switch_to_y': True, 'to_automat': True},
+    {'trigger': 'silence_detected', 'source': States.STUDIO_X_ON_AIR_STUDIO_Y_TAKEOVER_REQUEST, 'dest': States.FROM_AUTOMAT_ON_AIR_CHANGE_TO_STUDIO_X_ON_NEXT_HOUR,
+     'switch_to_y': True, 'to_automat': True},
 ]
@@ -2,6 +2,7 @@ import bermudafunk.dispatcher
 from bermudafunk import base, GPIO
 from bermudafunk.SymNet import SymNetDevice, SymNetSelectorControllerDummy
 from bermudafunk.dispatcher import web
+from bermudafunk.dispatcher.journal import TransitionJournal
 
 if __name__ == '__main__':
     base.logger.debug('Main Start')
@@ -41,6 +42,7 @@ if __name__ == '__main__':
             bermudafunk.dispatcher.DispatcherStudioDefinition(studio=af_3, selector_value=4),
         ]
     )
+    dispatcher.use_journal(TransitionJournal('state.journal', dispatcher.file_path))
     dispatcher.load()
     dispatcher.start()
 